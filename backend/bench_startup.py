@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the API server.
+
+Measures, against the MongoDB configured in backend/.env:
+  1. import time of the server module, in fresh interpreters
+  2. lifespan startup (Mongo pool warm-up, index checks)
+  3. latency of the first and following requests, with and without a Mongo round-trip
+
+Usage: python bench_startup.py [--runs N]
+"""
+
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import server; print(time.perf_counter() - t)"
+
+
+def measure_import(runs):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET],
+            cwd=BACKEND_DIR,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+async def measure_requests(runs):
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    # create_app configures module-level state, so reuse the app built at import
+    app = server.app
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        startup = time.perf_counter() - started
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def timed(method, url, **kwargs):
+                t = time.perf_counter()
+                await client.request(method, url, **kwargs)
+                return time.perf_counter() - t
+
+            # An unknown login does a single users lookup and answers 401
+            login = {"email": "bench@example.com", "password": "not-a-password"}
+            first_root = await timed("GET", "/api/")
+            first_mongo = await timed("POST", "/api/auth/login", json=login)
+            warm_root = [await timed("GET", "/api/") for _ in range(runs)]
+            warm_mongo = [await timed("POST", "/api/auth/login", json=login) for _ in range(runs)]
+
+    return startup, first_root, first_mongo, warm_root, warm_mongo
+
+
+def ms(seconds):
+    return f"{seconds * 1000:8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    imports = measure_import(args.runs)
+    startup, first_root, first_mongo, warm_root, warm_mongo = asyncio.run(measure_requests(args.runs))
+
+    print(f"import server (median of {args.runs}):  {ms(statistics.median(imports))}")
+    print(f"lifespan startup:                  {ms(startup)}")
+    print(f"first GET /api/:                   {ms(first_root)}")
+    print(f"first POST /api/auth/login:        {ms(first_mongo)}")
+    print(f"warm GET /api/ (median):           {ms(statistics.median(warm_root))}")
+    print(f"warm POST /api/auth/login (median):{ms(statistics.median(warm_mongo))}")
+
+
+if __name__ == "__main__":
+    main()
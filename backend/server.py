@@ -1,16 +1,27 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid
 import os
+import asyncio
+import base64
+import hashlib
 import logging
+import math
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import List, Literal, Optional
+from contextlib import asynccontextmanager
 import uuid
+import time
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 import jwt
+import aiofiles
 from passlib.context import CryptContext
 import socketio
 
@@ -18,19 +29,102 @@ ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 #this is file
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+class Settings(BaseModel):
+    """Deployment settings consumed by create_app. from_env reads each field from its upper-cased name."""
+    mongo_url: str
+    db_name: str
+    jwt_secret_key: str = 'your-secret-key-change-in-production'
+    cors_origins: List[str] = ['*']
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 10
+    # Comma separated. zlib ships with Python; zstd and snappy also need the zstandard
+    # and python-snappy packages, without which the driver warns and skips them
+    mongo_compressors: str = 'zlib'
+    mongo_server_selection_timeout_ms: int = 5000
+    mongo_connect_timeout_ms: int = 5000
+    mongo_socket_timeout_ms: int = 30000
+    contacts_cache_ttl_seconds: int = 300
+    # Past either threshold, API requests are shed with 429 until the averages recover
+    event_loop_lag_threshold_ms: float = 250
+    mongo_latency_threshold_ms: float = 500
+    attachments_dir: Path = ROOT_DIR / 'attachments'
+    attachment_max_bytes: int = 100 * 1024 * 1024
+    archive_after_days: int = 90
+    archive_interval_seconds: int = 3600
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        env = os.environ
+        values = {name: env[name.upper()] for name in cls.model_fields if name.upper() in env}
+        if 'cors_origins' in values:
+            values['cors_origins'] = values['cors_origins'].split(',')
+        return cls(**values)
+
+# MongoDB connection, opened and closed by the app lifespan
+client: Optional[AsyncIOMotorClient] = None
+db = None
+app_settings: Optional[Settings] = None  # set by create_app
 
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
+SECRET_KEY: Optional[str] = None  # set by create_app
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
 security = HTTPBearer()
 
+# Values marked "set by create_app" come from Settings
+
+# Contacts cache
+CONTACTS_PAGE_SIZE = 200
+MAX_CONTACTS_PAGE_SIZE = 1000
+CACHE_MAX_ENTRIES = 10000
+# Upper bound on user documents held across all cached contact pages
+CONTACTS_CACHE_MAX_DOCUMENTS = 100000
+CACHE_SWEEP_INTERVAL_SECONDS = 60
+
+# Groups
+GROUPS_PAGE_SIZE = 200
+MAX_GROUPS_PAGE_SIZE = 1000
+
+# Admission control
+RATE_LIMITS = {
+    # route: (tokens refilled per second, bucket size)
+    "send_message": (5.0, 20),
+    "search_users": (2.0, 10),
+    "typing": (2.0, 5),
+}
+EVENT_LOOP_LAG_THRESHOLD_MS: Optional[float] = None  # set by create_app
+MONGO_LATENCY_THRESHOLD_MS: Optional[float] = None  # set by create_app
+LOAD_SHED_RETRY_AFTER_SECONDS = 2
+
+# Attachments
+ATTACHMENTS_DIR: Optional[Path] = None  # set by create_app
+ATTACHMENT_MAX_BYTES: Optional[int] = None  # set by create_app
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+# How long a chunk upload may hold the claim on its offset while it is copied into the blob
+ATTACHMENT_LEASE_SECONDS = 60
+ATTACHMENT_EXPIRY_INTERVAL_SECONDS = 300
+ATTACHMENT_EXPIRY_BATCH_SIZE = 100
+
+# Message retention
+ARCHIVE_AFTER_DAYS: Optional[int] = None  # set by create_app
+ARCHIVE_INTERVAL_SECONDS: Optional[int] = None  # set by create_app
+ARCHIVE_BATCH_SIZE = 1000
+MAX_RETENTION_TTL_SECONDS = 365 * 24 * 3600
+HISTORY_LIMIT = 1000
+
+# Audit logs
+AUDIT_LOGS_PAGE_SIZE = 100
+MAX_AUDIT_LOGS_PAGE_SIZE = 500
+# Bucket keys are prefixes of the stored ISO timestamps, so rollups can also be rebuilt from raw logs
+AUDIT_ROLLUP_BUCKETS = {"hour": 13, "day": 10}
+AUDIT_SUMMARY_DEFAULT_WINDOW = {"hour": timedelta(hours=48), "day": timedelta(days=30)}
+
+# Conversation key backfill
+CONVERSATION_BACKFILL_BATCH_SIZE = 1000
+conversation_backfill_done = False
+
 # Socket.IO setup
 sio = socketio.AsyncServer(
     async_mode='asgi',
@@ -39,8 +133,6 @@ sio = socketio.AsyncServer(
     engineio_logger=True
 )
 
-# Create the main app
-app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 # Pydantic Models
@@ -72,6 +164,7 @@ class MessageCreate(BaseModel):
     encrypted_content: str
     iv: str
     sender_public_key: str
+    attachment_id: Optional[str] = None
 
 class Message(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -82,9 +175,66 @@ class Message(BaseModel):
     iv: str
     sender_public_key: str
     timestamp: datetime
+    conversation_id: Optional[str] = None
+    attachment_id: Optional[str] = None
+    expires_at: Optional[datetime] = None
     is_delivered: bool = False
     is_read: bool = False
 
+class GroupCreate(BaseModel):
+    name: str
+    member_ids: List[str] = []
+
+class GroupMemberAdd(BaseModel):
+    user_id: str
+
+class Group(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    name: str
+    owner_id: str
+    created_at: datetime
+    last_message_at: Optional[datetime] = None
+    last_read_at: Optional[datetime] = None
+
+class GroupMessageCreate(BaseModel):
+    encrypted_content: str
+    iv: str
+    sender_public_key: str
+    attachment_id: Optional[str] = None
+
+class GroupMessage(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    group_id: str
+    conversation_id: str
+    sender_id: str
+    encrypted_content: str
+    iv: str
+    sender_public_key: str
+    timestamp: datetime
+    attachment_id: Optional[str] = None
+    expires_at: Optional[datetime] = None
+
+class GroupReadCursor(BaseModel):
+    timestamp: datetime
+
+class AttachmentCreate(BaseModel):
+    size: int = Field(gt=0)
+
+class Attachment(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    owner_id: str
+    size: int
+    received: int
+    status: str
+    created_at: datetime
+
+class RetentionUpdate(BaseModel):
+    # None turns disappearing messages off
+    ttl_seconds: Optional[int] = Field(None, gt=0, le=MAX_RETENTION_TTL_SECONDS)
+
 class AuditLogCreate(BaseModel):
     event_type: str
     chat_id: Optional[str] = None
@@ -99,6 +249,11 @@ class AuditLog(BaseModel):
     device_info: Optional[str]
     timestamp: datetime
 
+class AuditLogRollup(BaseModel):
+    bucket: str
+    event_type: str
+    count: int
+
 class ContactAdd(BaseModel):
     contact_id: str
 
@@ -106,6 +261,190 @@ class DeleteAccountConfirm(BaseModel):
     password: str
     confirmation_text: str
 
+class TTLCache:
+    """
+    Small in-process LRU cache of entries grouped by scope (e.g. a user id)
+    that expire after a fixed TTL. Each entry has a size (1 unless given);
+    once max_entries or max_size is exceeded the least recently used entries
+    are evicted. sweep() drops expired entries.
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int = CACHE_MAX_ENTRIES, max_size: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_size = max_size if max_size is not None else max_entries
+        self.size = 0
+        self._entries = OrderedDict()
+        self._scopes = {}
+
+    def get(self, scope: str, key):
+        entry = self._entries.get((scope, key))
+        if entry is None:
+            return None
+        expires_at, value, _ = entry
+        if expires_at < time.monotonic():
+            self._remove((scope, key))
+            return None
+        self._entries.move_to_end((scope, key))
+        return value
+
+    def set(self, scope: str, key, value, size: int = 1):
+        if size > self.max_size:
+            return
+        self._remove((scope, key))
+        self._entries[(scope, key)] = (time.monotonic() + self.ttl_seconds, value, size)
+        self._scopes.setdefault(scope, set()).add(key)
+        self.size += size
+        while len(self._entries) > self.max_entries or self.size > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, *scopes: str):
+        for scope in scopes:
+            for key in list(self._scopes.get(scope, ())):
+                self._remove((scope, key))
+
+    def sweep(self):
+        now = time.monotonic()
+        for entry_key, (expires_at, _, _) in list(self._entries.items()):
+            if expires_at < now:
+                self._remove(entry_key)
+
+    def _remove(self, entry_key):
+        scope, key = entry_key
+        entry = self._entries.pop(entry_key, None)
+        if entry is not None:
+            self.size -= entry[2]
+        keys = self._scopes.get(scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._scopes[scope]
+
+contacts_cache: Optional[TTLCache] = None  # set by create_app
+
+async def sweep_caches():
+    while True:
+        await asyncio.sleep(CACHE_SWEEP_INTERVAL_SECONDS)
+        contacts_cache.sweep()
+        rate_limiter.prune()
+
+# Conditional GET
+# ETags derive from version counters stored on the user document (contacts_version,
+# audit_logs_version), which every write bumps, so all workers agree on them
+USER_CACHE_CONTROL = "private, max-age=60"
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+def make_etag(key, version: int, *params) -> str:
+    stamp = repr((key, version, params)).encode()
+    return f'"{hashlib.sha1(stamp).hexdigest()[:16]}"'
+
+def stored_version(request: Request, field: str) -> int:
+    """Version counter from the caller's user document, loaded by get_current_user."""
+    return request.state.user_doc.get(field, 0)
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+class TokenBucketLimiter:
+    """In-process token buckets keyed by (user id, route)."""
+
+    def __init__(self, limits: dict):
+        self.limits = limits
+        self._buckets = {}
+
+    def acquire(self, user_id: str, route: str) -> float:
+        """Take one token. Returns 0 when allowed, otherwise the seconds until a token is free."""
+        rate, burst = self.limits[route]
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get((user_id, route), (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        if tokens >= 1:
+            self._buckets[(user_id, route)] = (tokens - 1, now)
+            return 0.0
+        self._buckets[(user_id, route)] = (tokens, now)
+        return (1 - tokens) / rate
+
+    def prune(self):
+        # A bucket that has refilled completely behaves like a new one, so it can be dropped
+        now = time.monotonic()
+        for (user_id, route), (tokens, updated_at) in list(self._buckets.items()):
+            rate, burst = self.limits[route]
+            if tokens + (now - updated_at) * rate >= burst:
+                del self._buckets[(user_id, route)]
+
+class LoadMonitor:
+    """Tracks event-loop lag and Mongo round-trip latency as moving averages."""
+
+    interval_seconds = 0.5
+    smoothing = 0.3
+
+    def __init__(self):
+        self.event_loop_lag_ms = 0.0
+        self.mongo_latency_ms = 0.0
+
+    def overloaded(self) -> bool:
+        return (
+            self.event_loop_lag_ms > EVENT_LOOP_LAG_THRESHOLD_MS
+            or self.mongo_latency_ms > MONGO_LATENCY_THRESHOLD_MS
+        )
+
+    def _record(self, attr: str, value_ms: float):
+        previous = getattr(self, attr)
+        setattr(self, attr, previous + self.smoothing * (value_ms - previous))
+
+    async def watch_event_loop(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval_seconds)
+            lag = (time.monotonic() - started - self.interval_seconds) * 1000
+            self._record("event_loop_lag_ms", max(lag, 0.0))
+
+    async def watch_mongo(self):
+        while True:
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(db.command("ping"), timeout=MONGO_LATENCY_THRESHOLD_MS * 4 / 1000)
+                latency = (time.monotonic() - started) * 1000
+            except Exception as e:
+                logging.warning(f"Mongo ping failed: {e}")
+                latency = MONGO_LATENCY_THRESHOLD_MS * 4
+            self._record("mongo_latency_ms", latency)
+            await asyncio.sleep(self.interval_seconds)
+
+rate_limiter = TokenBucketLimiter(RATE_LIMITS)
+load_monitor = LoadMonitor()
+background_tasks = []
+
+def run_in_background(coro):
+    """Start a long-running task that is cancelled on shutdown and logs if it crashes."""
+    def log_failure(task):
+        if not task.cancelled() and task.exception():
+            logging.error(f"Background task {task.get_name()} failed: {task.exception()!r}")
+    task = asyncio.create_task(coro, name=coro.__name__)
+    task.add_done_callback(log_failure)
+    background_tasks.append(task)
+
+def rate_limited(route: str):
+    """Dependency that authenticates the caller and charges one token from their bucket for `route`."""
+    async def dependency(current_user: User = Depends(get_current_user)) -> User:
+        retry_after = rate_limiter.acquire(current_user.id, route)
+        if retry_after:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+        return current_user
+    return dependency
+
 # Helper functions
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -113,6 +452,295 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def as_utc(value: datetime) -> datetime:
+    """Client-supplied datetimes without an offset are taken as UTC, not server-local time."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def conversation_id_for(user_a: str, user_b: str) -> str:
+    """Key shared by both directions of a 1:1 conversation."""
+    return ":".join(sorted([user_a, user_b]))
+
+async def backfill_conversation_ids(batch_size: int = CONVERSATION_BACKFILL_BATCH_SIZE):
+    """
+    Stamp conversation_id on messages written before it existed.
+    Progress is saved in the migrations collection after every batch, so an
+    interrupted run resumes from the last processed _id.
+    """
+    global conversation_backfill_done
+    migration = await db.migrations.find_one({"name": "conversation_id"}) or {}
+    last_id = migration.get("last_id")
+    
+    while not migration.get("completed"):
+        query = {"conversation_id": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db.messages.find(
+            query,
+            {"_id": 1, "sender_id": 1, "receiver_id": 1}
+        ).sort("_id", 1).to_list(batch_size)
+        
+        if not batch:
+            await db.migrations.update_one(
+                {"name": "conversation_id"},
+                {"$set": {"completed": True, "completed_at": datetime.now(timezone.utc).isoformat()}},
+                upsert=True
+            )
+            break
+        
+        await db.messages.bulk_write([
+            UpdateOne(
+                {"_id": msg["_id"]},
+                {"$set": {"conversation_id": conversation_id_for(msg["sender_id"], msg["receiver_id"])}}
+            )
+            for msg in batch
+        ], ordered=False)
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"name": "conversation_id"},
+            {"$set": {"last_id": last_id}},
+            upsert=True
+        )
+        logging.info(f"Backfilled conversation_id on {len(batch)} messages")
+    
+    conversation_backfill_done = True
+
+def group_room(group_id: str) -> str:
+    return f"group:{group_id}"
+
+async def set_group_room_membership(user_id: str, group_id: str, joined: bool):
+    """
+    Add or remove every connected socket of a user to/from a group's room.
+    The socket manager only sees sockets connected to this process, and sio
+    has no shared client manager, so this (like every emit) assumes a single
+    worker. Running several needs e.g. socketio.AsyncRedisManager plus a
+    broadcast that makes each worker apply room changes to its own sockets.
+    """
+    for sid, _ in list(sio.manager.get_participants('/', user_id)):
+        if joined:
+            await sio.enter_room(sid, group_room(group_id))
+        else:
+            await sio.leave_room(sid, group_room(group_id))
+
+async def promote_successor_admin(group_id: str):
+    """After an admin leaves, make the longest-standing member admin if no admin is left."""
+    if await db.group_members.find_one({"group_id": group_id, "role": "admin"}, {"_id": 1}):
+        return
+    successor = await db.group_members.find_one({"group_id": group_id}, sort=[("joined_at", 1)])
+    if successor:
+        await db.group_members.update_one({"_id": successor["_id"]}, {"$set": {"role": "admin"}})
+
+async def get_group_membership(group_id: str, user_id: str) -> dict:
+    membership = await db.group_members.find_one({"group_id": group_id, "user_id": user_id}, {"_id": 0})
+    if not membership:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return membership
+
+def attachment_path(attachment_id: str) -> Path:
+    return ATTACHMENTS_DIR / attachment_id
+
+def parse_range(range_header: str, size: int):
+    """Parse a single `bytes=` range into (start, end) inclusive, or None if unsatisfiable."""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if not start:
+            # Suffix range: the last N bytes
+            length = int(end)
+            if length <= 0:
+                return None
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return None
+    return start, min(end, size - 1)
+
+async def stream_file_range(path: Path, start: int, length: int):
+    async with aiofiles.open(path, 'rb') as f:
+        await f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await f.read(min(ATTACHMENT_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+async def share_attachment(
+    attachment_id: str,
+    owner_id: str,
+    user_id: str = None,
+    group_id: str = None,
+    expires_at: Optional[datetime] = None
+):
+    """
+    Grant the recipient of a message access to the attachment it references.
+    A grant from a disappearing message lapses when the message expires, and
+    the attachment is deleted once every message that shared it has expired.
+    """
+    grant = {"user_id": user_id} if user_id else {"group_id": group_id}
+    grant["expires_at"] = expires_at.isoformat() if expires_at else None
+    update = {"$addToSet": {"grants": grant}}
+    if expires_at:
+        update["$max"] = {"grants_expire_at": grant["expires_at"]}
+    else:
+        update["$set"] = {"retained": True}
+    result = await db.attachments.update_one(
+        {"id": attachment_id, "owner_id": owner_id, "status": "complete"},
+        update
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=400, detail="Attachment not found or upload incomplete")
+
+async def message_expiry(conversation_id: str, sent_at: datetime) -> Optional[datetime]:
+    """Expiry for a new message in a conversation with disappearing messages, else None."""
+    # Read on every send rather than cached per worker: a message stored without an
+    # expiry after retention was turned on would never disappear
+    settings = await db.conversation_settings.find_one({"conversation_id": conversation_id}, {"_id": 0, "ttl_seconds": 1})
+    ttl_seconds = (settings or {}).get("ttl_seconds")
+    if not ttl_seconds:
+        return None
+    return sent_at + timedelta(seconds=min(ttl_seconds, MAX_RETENTION_TTL_SECONDS))
+
+async def find_conversation_history(query: dict, limit: int = HISTORY_LIMIT) -> list:
+    """
+    The newest `limit` unexpired messages matching `query`, oldest first. The
+    archive is only read when the hot collection cannot fill the page.
+    """
+    # The TTL monitor runs about once a minute, so expired messages can linger briefly
+    query = {**query, "expires_at": {"$not": {"$lte": datetime.now(timezone.utc)}}}
+    messages = await db.messages.find(query, {"_id": 0}).sort("timestamp", -1).to_list(limit)
+    if len(messages) < limit:
+        archive_query = query
+        if messages:
+            archive_query = {"$and": [query, {"timestamp": {"$lte": messages[-1]["timestamp"]}}]}
+        archived = await db.messages_archive.find(archive_query, {"_id": 0}).sort("timestamp", -1).to_list(limit)
+        # A batch interrupted mid-archive leaves a message in both collections
+        seen = {msg["id"] for msg in messages}
+        messages += [msg for msg in archived if msg["id"] not in seen]
+        messages = sorted(messages, key=lambda msg: msg["timestamp"], reverse=True)[:limit]
+    
+    for msg in messages:
+        # Mongo returns naive datetimes
+        if msg.get("expires_at") and msg["expires_at"].tzinfo is None:
+            msg["expires_at"] = msg["expires_at"].replace(tzinfo=timezone.utc)
+    return messages[::-1]
+
+async def archive_old_messages():
+    """
+    Periodically move messages older than ARCHIVE_AFTER_DAYS into the compressed
+    messages_archive collection. Copies keep their _id, so a batch interrupted
+    between insert and delete is simply retried.
+    """
+    while True:
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+        archived = 0
+        while True:
+            # Disappearing messages are left to the TTL index
+            batch = await db.messages.find({
+                "timestamp": {"$lt": cutoff},
+                "conversation_id": {"$exists": True},
+                "expires_at": None
+            }).sort("timestamp", 1).to_list(ARCHIVE_BATCH_SIZE)
+            if not batch:
+                break
+            try:
+                await db.messages_archive.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                    raise
+            await db.messages.delete_many({"_id": {"$in": [msg["_id"] for msg in batch]}})
+            archived += len(batch)
+        if archived:
+            logging.info(f"Archived {archived} messages older than {cutoff}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+async def delete_expired_attachments() -> int:
+    """Delete attachments, and their blobs, that were only shared by messages that have expired."""
+    deleted = 0
+    while True:
+        query = {"grants_expire_at": {"$lte": datetime.now(timezone.utc).isoformat()}, "retained": {"$ne": True}}
+        batch = await db.attachments.find(query, {"_id": 0, "id": 1}).to_list(ATTACHMENT_EXPIRY_BATCH_SIZE)
+        if not batch:
+            return deleted
+        for attachment in batch:
+            # The filter is checked again, so an attachment shared in the meantime is kept
+            result = await db.attachments.delete_one({**query, "id": attachment["id"]})
+            if result.deleted_count:
+                attachment_path(attachment["id"]).unlink(missing_ok=True)
+                deleted += 1
+
+async def expire_attachments():
+    while True:
+        deleted = await delete_expired_attachments()
+        if deleted:
+            logging.info(f"Deleted {deleted} attachments shared only by expired messages")
+        await asyncio.sleep(ATTACHMENT_EXPIRY_INTERVAL_SECONDS)
+
+def encode_audit_cursor(log: dict) -> str:
+    return base64.urlsafe_b64encode(f"{log['timestamp']}|{log['id']}".encode()).decode()
+
+def decode_audit_cursor(cursor: str):
+    try:
+        timestamp, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return timestamp, log_id
+
+async def backfill_audit_rollups(cutoff: datetime):
+    """
+    Rebuild rollups for audit logs written before rollups were maintained at ingest.
+    `cutoff` must precede any ingest by this process; the first run's cutoff is kept.
+    Counts go to a separate backfilled_count field and are replaced, not added, so
+    re-running after an interruption is safe and never double counts ingest totals.
+    Users whose counts changed get their audit_logs_version bumped, so summaries
+    fetched during the backfill stop matching their ETags.
+    """
+    migration = await db.migrations.find_one_and_update(
+        {"name": "audit_rollups"},
+        {"$setOnInsert": {"cutoff": cutoff.isoformat()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    if migration.get("completed"):
+        return
+    
+    for granularity, prefix_length in AUDIT_ROLLUP_BUCKETS.items():
+        await db.audit_logs.aggregate([
+            {"$match": {"timestamp": {"$lt": migration["cutoff"]}}},
+            {"$group": {
+                "_id": {
+                    "user_id": "$user_id",
+                    "event_type": "$event_type",
+                    "bucket": {"$substrBytes": ["$timestamp", 0, prefix_length]}
+                },
+                "backfilled_count": {"$sum": 1}
+            }},
+            {"$project": {
+                "_id": 0,
+                "user_id": "$_id.user_id",
+                "event_type": "$_id.event_type",
+                "granularity": granularity,
+                "bucket": "$_id.bucket",
+                "backfilled_count": 1
+            }},
+            {"$merge": {
+                "into": "audit_rollups",
+                "on": ["user_id", "granularity", "bucket", "event_type"],
+                "whenMatched": [{"$set": {"backfilled_count": "$$new.backfilled_count"}}],
+                "whenNotMatched": "insert"
+            }}
+        ]).to_list(None)
+    
+    user_ids = await db.audit_rollups.distinct("user_id", {"backfilled_count": {"$exists": True}})
+    await db.users.update_many({"id": {"$in": user_ids}}, {"$inc": {"audit_logs_version": 1}})
+    await db.migrations.update_one({"name": "audit_rollups"}, {"$set": {"completed": True}})
+    logging.info("Backfilled audit log rollups")
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -120,7 +748,7 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -133,6 +761,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     user = await db.users.find_one({"id": user_id}, {"_id": 0})
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
+    request.state.user_doc = user
     
     if isinstance(user.get('created_at'), str):
         user['created_at'] = datetime.fromisoformat(user['created_at'])
@@ -196,7 +825,7 @@ async def login(credentials: UserLogin):
 
 # User routes
 @api_router.get("/users/search", response_model=List[User])
-async def search_users(q: str, current_user: User = Depends(get_current_user)):
+async def search_users(q: str, current_user: User = Depends(rate_limited("search_users"))):
     if len(q) < 2:
         return []
     
@@ -218,14 +847,26 @@ async def search_users(q: str, current_user: User = Depends(get_current_user)):
     return [User(**user) for user in users]
 
 @api_router.get("/users/{user_id}", response_model=User)
-async def get_user(user_id: str, current_user: User = Depends(get_current_user)):
+async def get_user(
+    user_id: str,
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
     user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
+    # Profiles never change after registration, so the public key identifies the representation
+    etag = make_etag(("user", user_id), 0, user["public_key"])
+    if etag_matches(request, etag):
+        return not_modified(etag, USER_CACHE_CONTROL)
+    
     if isinstance(user.get('created_at'), str):
         user['created_at'] = datetime.fromisoformat(user['created_at'])
     
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = USER_CACHE_CONTROL
     return User(**user)
 
 @api_router.delete("/users/me")
@@ -247,20 +888,38 @@ async def delete_account(delete_data: DeleteAccountConfirm, current_user: User =
     try:
         # 1. Delete all messages sent by user
         await db.messages.delete_many({"sender_id": current_user.id})
+        await db.messages_archive.delete_many({"sender_id": current_user.id})
         
         # 2. Delete all messages received by user
         await db.messages.delete_many({"receiver_id": current_user.id})
+        await db.messages_archive.delete_many({"receiver_id": current_user.id})
         
         # 3. Delete user's contacts
         await db.contacts.delete_many({"user_id": current_user.id})
         
         # 4. Delete user from other users' contact lists
+        contact_owner_ids = await db.contacts.distinct("user_id", {"contact_id": current_user.id})
         await db.contacts.delete_many({"contact_id": current_user.id})
+        await db.users.update_many({"id": {"$in": contact_owner_ids}}, {"$inc": {"contacts_version": 1}})
+        contacts_cache.invalidate(current_user.id, *contact_owner_ids)
+        
+        # 5. Remove user from groups (their group messages went with step 1)
+        admin_group_ids = await db.group_members.distinct("group_id", {"user_id": current_user.id, "role": "admin"})
+        await db.group_members.delete_many({"user_id": current_user.id})
+        for group_id in admin_group_ids:
+            await promote_successor_admin(group_id)
         
-        # 5. Delete audit logs
+        # 6. Delete uploaded attachments
+        owned_attachment_ids = await db.attachments.distinct("id", {"owner_id": current_user.id})
+        await db.attachments.delete_many({"owner_id": current_user.id})
+        for attachment_id in owned_attachment_ids:
+            attachment_path(attachment_id).unlink(missing_ok=True)
+        
+        # 7. Delete audit logs
         await db.audit_logs.delete_many({"user_id": current_user.id})
+        await db.audit_rollups.delete_many({"user_id": current_user.id})
         
-        # 6. Finally, delete the user account
+        # 8. Finally, delete the user account
         await db.users.delete_one({"id": current_user.id})
         
         # Log the deletion event
@@ -277,16 +936,30 @@ async def delete_account(delete_data: DeleteAccountConfirm, current_user: User =
 
 # Message routes
 @api_router.post("/messages", response_model=Message)
-async def send_message(message_data: MessageCreate, current_user: User = Depends(get_current_user)):
+async def send_message(message_data: MessageCreate, current_user: User = Depends(rate_limited("send_message"))):
     message_id = str(uuid.uuid4())
+    conversation_id = conversation_id_for(current_user.id, message_data.receiver_id)
+    now = datetime.now(timezone.utc)
+    expires_at = await message_expiry(conversation_id, now)
+    if message_data.attachment_id:
+        await share_attachment(
+            message_data.attachment_id,
+            current_user.id,
+            user_id=message_data.receiver_id,
+            expires_at=expires_at
+        )
+    
     message_dict = {
         "id": message_id,
+        "conversation_id": conversation_id,
         "sender_id": current_user.id,
         "receiver_id": message_data.receiver_id,
         "encrypted_content": message_data.encrypted_content,
         "iv": message_data.iv,
         "sender_public_key": message_data.sender_public_key,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "attachment_id": message_data.attachment_id,
+        "timestamp": now.isoformat(),
+        "expires_at": expires_at,
         "is_delivered": False,
         "is_read": False
     }
@@ -300,7 +973,10 @@ async def send_message(message_data: MessageCreate, current_user: User = Depends
         encrypted_content=message_data.encrypted_content,
         iv=message_data.iv,
         sender_public_key=message_data.sender_public_key,
-        timestamp=datetime.now(timezone.utc),
+        timestamp=now,
+        conversation_id=conversation_id,
+        attachment_id=message_data.attachment_id,
+        expires_at=expires_at,
         is_delivered=False,
         is_read=False
     )
@@ -312,15 +988,18 @@ async def send_message(message_data: MessageCreate, current_user: User = Depends
 
 @api_router.get("/messages/{other_user_id}", response_model=List[Message])
 async def get_messages(other_user_id: str, current_user: User = Depends(get_current_user)):
-    messages = await db.messages.find(
-        {
+    if conversation_backfill_done:
+        query = {"conversation_id": conversation_id_for(current_user.id, other_user_id)}
+    else:
+        # Older messages may not carry conversation_id until the backfill finishes
+        query = {
             "$or": [
                 {"sender_id": current_user.id, "receiver_id": other_user_id},
                 {"sender_id": other_user_id, "receiver_id": current_user.id}
             ]
-        },
-        {"_id": 0}
-    ).sort("timestamp", 1).to_list(1000)
+        }
+    
+    messages = await find_conversation_history(query)
     
     for msg in messages:
         if isinstance(msg.get('timestamp'), str):
@@ -328,43 +1007,528 @@ async def get_messages(other_user_id: str, current_user: User = Depends(get_curr
     
     return [Message(**msg) for msg in messages]
 
+# Groups
+# Each group message is stored once and delivered with one room emit; members
+# track what they have read with a per-member cursor instead of per-message flags.
+@api_router.post("/groups", response_model=Group)
+async def create_group(group_data: GroupCreate, current_user: User = Depends(get_current_user)):
+    member_ids = list(dict.fromkeys([current_user.id, *group_data.member_ids]))
+    if await db.users.count_documents({"id": {"$in": member_ids}}) != len(member_ids):
+        raise HTTPException(status_code=400, detail="Unknown group member")
+    
+    group_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc).isoformat()
+    group_dict = {
+        "id": group_id,
+        "name": group_data.name,
+        "owner_id": current_user.id,
+        "created_at": now,
+        "last_message_at": None
+    }
+    await db.groups.insert_one(group_dict)
+    await db.group_members.insert_many([
+        {
+            "group_id": group_id,
+            "user_id": member_id,
+            "role": "admin" if member_id == current_user.id else "member",
+            "joined_at": now
+        }
+        for member_id in member_ids
+    ])
+    
+    for member_id in member_ids:
+        await set_group_room_membership(member_id, group_id, joined=True)
+    group_obj = Group(**{**group_dict, "created_at": datetime.fromisoformat(now)})
+    await sio.emit('group_added', group_obj.model_dump(mode='json'), to=member_ids)
+    
+    return group_obj
+
+@api_router.get("/groups", response_model=List[Group])
+async def get_groups(
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(GROUPS_PAGE_SIZE, ge=1, le=MAX_GROUPS_PAGE_SIZE),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Return a page of the user's groups, most recently active first. The total
+    number of groups is sent in the X-Total-Count header.
+    """
+    result = await db.group_members.aggregate([
+        {"$match": {"user_id": current_user.id}},
+        {"$lookup": {
+            "from": "groups",
+            "localField": "group_id",
+            "foreignField": "id",
+            "as": "group"
+        }},
+        {"$unwind": "$group"},
+        {"$addFields": {"group.last_read_at": "$last_read_at"}},
+        {"$replaceRoot": {"newRoot": "$group"}},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "groups": [
+                {"$sort": {"last_message_at": -1, "id": 1}},
+                {"$skip": skip},
+                {"$limit": limit},
+                {"$project": {"_id": 0}}
+            ]
+        }}
+    ]).to_list(1)
+    
+    page = result[0] if result else {"total": [], "groups": []}
+    groups = page["groups"]
+    response.headers["X-Total-Count"] = str(page["total"][0]["count"] if page["total"] else 0)
+    
+    for group in groups:
+        for field in ('created_at', 'last_message_at', 'last_read_at'):
+            if isinstance(group.get(field), str):
+                group[field] = datetime.fromisoformat(group[field])
+    
+    return [Group(**group) for group in groups]
+
+@api_router.post("/groups/{group_id}/members")
+async def add_group_member(group_id: str, member_data: GroupMemberAdd, current_user: User = Depends(get_current_user)):
+    membership = await get_group_membership(group_id, current_user.id)
+    if membership["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only group admins can add members")
+    
+    if not await db.users.find_one({"id": member_data.user_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    result = await db.group_members.update_one(
+        {"group_id": group_id, "user_id": member_data.user_id},
+        {"$setOnInsert": {
+            "role": "member",
+            "joined_at": datetime.now(timezone.utc).isoformat()
+        }},
+        upsert=True
+    )
+    if result.upserted_id is None:
+        return {"message": "User is already a member"}
+    
+    await set_group_room_membership(member_data.user_id, group_id, joined=True)
+    group = await db.groups.find_one({"id": group_id}, {"_id": 0})
+    for field in ('created_at', 'last_message_at'):
+        if isinstance(group.get(field), str):
+            group[field] = datetime.fromisoformat(group[field])
+    await sio.emit('group_added', Group(**group).model_dump(mode='json'), room=member_data.user_id)
+    
+    return {"message": "Member added successfully"}
+
+@api_router.delete("/groups/{group_id}/members/{user_id}")
+async def remove_group_member(group_id: str, user_id: str, current_user: User = Depends(get_current_user)):
+    membership = await get_group_membership(group_id, current_user.id)
+    if user_id != current_user.id and membership["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only group admins can remove members")
+    
+    result = await db.group_members.find_one_and_delete({"group_id": group_id, "user_id": user_id})
+    if result is None:
+        raise HTTPException(status_code=404, detail="Member not found")
+    if result["role"] == "admin":
+        await promote_successor_admin(group_id)
+    
+    await set_group_room_membership(user_id, group_id, joined=False)
+    await sio.emit('group_removed', {'group_id': group_id}, room=user_id)
+    
+    return {"message": "Member removed successfully"}
+
+@api_router.post("/groups/{group_id}/messages", response_model=GroupMessage)
+async def send_group_message(
+    group_id: str,
+    message_data: GroupMessageCreate,
+    current_user: User = Depends(rate_limited("send_message"))
+):
+    await get_group_membership(group_id, current_user.id)
+    now = datetime.now(timezone.utc)
+    expires_at = await message_expiry(group_id, now)
+    if message_data.attachment_id:
+        await share_attachment(message_data.attachment_id, current_user.id, group_id=group_id, expires_at=expires_at)
+    
+    message_dict = {
+        "id": str(uuid.uuid4()),
+        "group_id": group_id,
+        "conversation_id": group_id,
+        "sender_id": current_user.id,
+        "encrypted_content": message_data.encrypted_content,
+        "iv": message_data.iv,
+        "sender_public_key": message_data.sender_public_key,
+        "attachment_id": message_data.attachment_id,
+        "timestamp": now.isoformat(),
+        "expires_at": expires_at
+    }
+    
+    await db.messages.insert_one(message_dict)
+    await db.groups.update_one({"id": group_id}, {"$set": {"last_message_at": now.isoformat()}})
+    
+    message_obj = GroupMessage(**{**message_dict, "timestamp": now})
+    
+    # One emit reaches every connected member, whatever the group size
+    await sio.emit('new_group_message', message_obj.model_dump(mode='json'), room=group_room(group_id))
+    
+    return message_obj
+
+@api_router.get("/groups/{group_id}/messages", response_model=List[GroupMessage])
+async def get_group_messages(group_id: str, current_user: User = Depends(get_current_user)):
+    await get_group_membership(group_id, current_user.id)
+    
+    messages = await find_conversation_history({"conversation_id": group_id})
+    
+    for msg in messages:
+        if isinstance(msg.get('timestamp'), str):
+            msg['timestamp'] = datetime.fromisoformat(msg['timestamp'])
+    
+    return [GroupMessage(**msg) for msg in messages]
+
+@api_router.post("/groups/{group_id}/read")
+async def mark_group_read(group_id: str, cursor: GroupReadCursor, current_user: User = Depends(get_current_user)):
+    await get_group_membership(group_id, current_user.id)
+    
+    # $max keeps the cursor from moving backwards when acknowledgements arrive out of order;
+    # clamping to now stops a future timestamp from marking messages read before they exist
+    read_at = min(cursor.timestamp.astimezone(timezone.utc), datetime.now(timezone.utc)).isoformat()
+    await db.group_members.update_one(
+        {"group_id": group_id, "user_id": current_user.id},
+        {"$max": {"last_read_at": read_at}}
+    )
+    
+    return {"message": "Read position updated", "last_read_at": read_at}
+
+# Attachments
+# Clients encrypt files before upload; the server only stores opaque blobs on disk
+@api_router.post("/attachments", response_model=Attachment)
+async def create_attachment(attachment_data: AttachmentCreate, current_user: User = Depends(get_current_user)):
+    if attachment_data.size > ATTACHMENT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Attachment is too large")
+    
+    attachment_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    attachment_dict = {
+        "id": attachment_id,
+        "owner_id": current_user.id,
+        "size": attachment_data.size,
+        "received": 0,
+        "status": "uploading",
+        "created_at": now.isoformat(),
+        "grants": []
+    }
+    
+    ATTACHMENTS_DIR.mkdir(parents=True, exist_ok=True)
+    attachment_path(attachment_id).touch()
+    await db.attachments.insert_one(attachment_dict)
+    
+    return Attachment(**{**attachment_dict, "created_at": now})
+
+@api_router.get("/attachments/{attachment_id}/status", response_model=Attachment)
+async def get_attachment_status(attachment_id: str, current_user: User = Depends(get_current_user)):
+    attachment = await db.attachments.find_one({"id": attachment_id, "owner_id": current_user.id}, {"_id": 0})
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    
+    if isinstance(attachment.get('created_at'), str):
+        attachment['created_at'] = datetime.fromisoformat(attachment['created_at'])
+    
+    return Attachment(**attachment)
+
+@api_router.put("/attachments/{attachment_id}/content", response_model=Attachment)
+async def upload_attachment_chunk(
+    attachment_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Append one chunk of the encrypted blob starting at `offset`.
+    An interrupted upload is resumed from the `received` count reported by
+    the status endpoint; chunks that don't start there are rejected with 409.
+    
+    The body is staged in a temp file, then the offset is claimed atomically
+    before the blob is touched, so concurrent uploads of the same range can't
+    interleave: one wins and the others get 409.
+    """
+    attachment = await db.attachments.find_one({"id": attachment_id, "owner_id": current_user.id}, {"_id": 0})
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    if attachment["status"] == "complete":
+        raise HTTPException(status_code=409, detail="Upload already complete")
+    if offset != attachment["received"]:
+        raise HTTPException(status_code=409, detail=f"Upload must resume at offset {attachment['received']}")
+    
+    lease_id = str(uuid.uuid4())
+    staging_path = ATTACHMENTS_DIR / f"{attachment_id}.{lease_id}.part"
+    try:
+        # Stage the body as it arrives so memory use doesn't depend on chunk size
+        written = 0
+        async with aiofiles.open(staging_path, 'wb') as staging:
+            async for chunk in request.stream():
+                if offset + written + len(chunk) > attachment["size"]:
+                    raise HTTPException(status_code=400, detail="Chunk exceeds declared attachment size")
+                await staging.write(chunk)
+                written += len(chunk)
+        
+        now = datetime.now(timezone.utc)
+        claimed = await db.attachments.find_one_and_update(
+            {
+                "id": attachment_id,
+                "status": "uploading",
+                "received": offset,
+                "$or": [{"lease_expires_at": None}, {"lease_expires_at": {"$lt": now.isoformat()}}]
+            },
+            {"$set": {
+                "lease_id": lease_id,
+                "lease_expires_at": (now + timedelta(seconds=ATTACHMENT_LEASE_SECONDS)).isoformat()
+            }},
+            projection={"_id": 0}
+        )
+        if claimed is None:
+            raise HTTPException(status_code=409, detail="Concurrent upload detected, check status and resume")
+        
+        async with aiofiles.open(staging_path, 'rb') as staging, \
+                aiofiles.open(attachment_path(attachment_id), 'r+b') as blob:
+            await blob.seek(offset)
+            while chunk := await staging.read(ATTACHMENT_CHUNK_SIZE):
+                await blob.write(chunk)
+    finally:
+        staging_path.unlink(missing_ok=True)
+    
+    received = offset + written
+    status_value = "complete" if received == attachment["size"] else "uploading"
+    result = await db.attachments.update_one(
+        {"id": attachment_id, "lease_id": lease_id},
+        {"$set": {"received": received, "status": status_value, "lease_id": None, "lease_expires_at": None}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=409, detail="Upload lease expired, check status and resume")
+    
+    attachment = claimed
+    attachment.update(received=received, status=status_value)
+    if isinstance(attachment.get('created_at'), str):
+        attachment['created_at'] = datetime.fromisoformat(attachment['created_at'])
+    
+    return Attachment(**attachment)
+
+@api_router.get("/attachments/{attachment_id}")
+async def download_attachment(attachment_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    attachment = await db.attachments.find_one({"id": attachment_id, "status": "complete"}, {"_id": 0})
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    
+    now = datetime.now(timezone.utc).isoformat()
+    grants = [grant for grant in attachment.get("grants", []) if not grant["expires_at"] or grant["expires_at"] > now]
+    group_ids = [grant["group_id"] for grant in grants if grant.get("group_id")]
+    allowed = (
+        attachment["owner_id"] == current_user.id
+        or any(grant.get("user_id") == current_user.id for grant in grants)
+        or (group_ids and await db.group_members.find_one(
+            {"group_id": {"$in": group_ids}, "user_id": current_user.id},
+            {"_id": 1}
+        ))
+    )
+    if not allowed:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    
+    # Blobs never change, but access can lapse or be revoked, so clients revalidate
+    # every use and get a 304 without the body while they still have access
+    etag = make_etag(("attachment", attachment_id), 0)
+    if etag_matches(request, etag):
+        return not_modified(etag, REVALIDATE_CACHE_CONTROL)
+    
+    path = attachment_path(attachment_id)
+    size = attachment["size"]
+    headers = {"Accept-Ranges": "bytes", "ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    
+    range_header = request.headers.get("range")
+    if not range_header:
+        # FileResponse streams from disk in fixed-size chunks, or hands the path to the server when it can send files itself
+        return FileResponse(path, media_type="application/octet-stream", headers=headers)
+    
+    byte_range = parse_range(range_header, size)
+    if byte_range is None:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    
+    start, end = byte_range
+    length = end - start + 1
+    return StreamingResponse(
+        stream_file_range(path, start, length),
+        status_code=206,
+        media_type="application/octet-stream",
+        headers={
+            **headers,
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(length)
+        }
+    )
+
+# Retention
+@api_router.put("/conversations/{conversation_id}/retention")
+async def set_conversation_retention(
+    conversation_id: str,
+    retention: RetentionUpdate,
+    current_user: User = Depends(get_current_user)
+):
+    """Enable or disable disappearing messages for a 1:1 conversation or a group (admins only)."""
+    if ":" in conversation_id:
+        parts = conversation_id.split(":")
+        if len(parts) != 2 or current_user.id not in parts or conversation_id != conversation_id_for(*parts):
+            raise HTTPException(status_code=400, detail="Invalid conversation id")
+    else:
+        membership = await get_group_membership(conversation_id, current_user.id)
+        if membership["role"] != "admin":
+            raise HTTPException(status_code=403, detail="Only group admins can change retention")
+    
+    await db.conversation_settings.update_one(
+        {"conversation_id": conversation_id},
+        {"$set": {
+            "ttl_seconds": retention.ttl_seconds,
+            "updated_by": current_user.id,
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }},
+        upsert=True
+    )
+    
+    return {"conversation_id": conversation_id, "ttl_seconds": retention.ttl_seconds}
+
 # Audit logs
 @api_router.post("/audit-logs", response_model=AuditLog)
 async def create_audit_log(log_data: AuditLogCreate, current_user: User = Depends(get_current_user)):
     log_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
     log_dict = {
         "id": log_id,
         "user_id": current_user.id,
         "event_type": log_data.event_type,
         "chat_id": log_data.chat_id,
         "device_info": log_data.device_info,
-        "timestamp": datetime.now(timezone.utc).isoformat()
+        "timestamp": now.isoformat()
     }
     
     await db.audit_logs.insert_one(log_dict)
     
+    # Keep hourly and daily counts current so summaries never scan raw logs
+    await db.audit_rollups.bulk_write([
+        UpdateOne(
+            {
+                "user_id": current_user.id,
+                "granularity": granularity,
+                "bucket": log_dict["timestamp"][:prefix_length],
+                "event_type": log_data.event_type
+            },
+            {"$inc": {"count": 1}},
+            upsert=True
+        )
+        for granularity, prefix_length in AUDIT_ROLLUP_BUCKETS.items()
+    ], ordered=False)
+    await db.users.update_one({"id": current_user.id}, {"$inc": {"audit_logs_version": 1}})
+    
     return AuditLog(
         id=log_id,
         user_id=current_user.id,
         event_type=log_data.event_type,
         chat_id=log_data.chat_id,
         device_info=log_data.device_info,
-        timestamp=datetime.now(timezone.utc)
+        timestamp=now
     )
 
 @api_router.get("/audit-logs", response_model=List[AuditLog])
-async def get_audit_logs(current_user: User = Depends(get_current_user)):
+async def get_audit_logs(
+    request: Request,
+    response: Response,
+    limit: int = Query(AUDIT_LOGS_PAGE_SIZE, ge=1, le=MAX_AUDIT_LOGS_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    event_type: Optional[str] = None,
+    chat_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Newest-first page of the user's audit logs, optionally filtered by event
+    type and chat. When more logs exist, the X-Next-Cursor header holds the
+    cursor for the following page.
+    """
+    etag = make_etag(
+        ("audit_logs", current_user.id),
+        stored_version(request, "audit_logs_version"),
+        limit, cursor, event_type, chat_id
+    )
+    if etag_matches(request, etag):
+        return not_modified(etag, REVALIDATE_CACHE_CONTROL)
+    
+    query = {"user_id": current_user.id}
+    if event_type:
+        query["event_type"] = event_type
+    if chat_id:
+        query["chat_id"] = chat_id
+    if cursor:
+        timestamp, log_id = decode_audit_cursor(cursor)
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "id": {"$lt": log_id}}
+        ]
+    
     logs = await db.audit_logs.find(
-        {"user_id": current_user.id},
+        query,
         {"_id": 0}
-    ).sort("timestamp", -1).to_list(100)
+    ).sort([("timestamp", -1), ("id", -1)]).to_list(limit + 1)
+    
+    if len(logs) > limit:
+        logs = logs[:limit]
+        response.headers["X-Next-Cursor"] = encode_audit_cursor(logs[-1])
     
     for log in logs:
         if isinstance(log.get('timestamp'), str):
             log['timestamp'] = datetime.fromisoformat(log['timestamp'])
     
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
     return [AuditLog(**log) for log in logs]
 
+@api_router.get("/audit-logs/summary", response_model=List[AuditLogRollup])
+async def get_audit_log_summary(
+    request: Request,
+    response: Response,
+    granularity: Literal["hour", "day"] = "day",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    event_type: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Event counts per hour or day bucket, read from the rollups maintained at ingest."""
+    prefix_length = AUDIT_ROLLUP_BUCKETS[granularity]
+    until = as_utc(until) if until else datetime.now(timezone.utc)
+    since = as_utc(since) if since else until - AUDIT_SUMMARY_DEFAULT_WINDOW[granularity]
+    since_bucket, until_bucket = since.isoformat()[:prefix_length], until.isoformat()[:prefix_length]
+    
+    # The resolved window is part of the ETag so a default window that moves on stops matching
+    etag = make_etag(
+        ("audit_logs", current_user.id),
+        stored_version(request, "audit_logs_version"),
+        "summary", granularity, since_bucket, until_bucket, event_type
+    )
+    if etag_matches(request, etag):
+        return not_modified(etag, REVALIDATE_CACHE_CONTROL)
+    
+    query = {
+        "user_id": current_user.id,
+        "granularity": granularity,
+        "bucket": {"$gte": since_bucket, "$lte": until_bucket}
+    }
+    if event_type:
+        query["event_type"] = event_type
+    
+    rollups = await db.audit_rollups.aggregate([
+        {"$match": query},
+        {"$sort": {"bucket": 1, "event_type": 1}},
+        {"$project": {
+            "_id": 0,
+            "bucket": 1,
+            "event_type": 1,
+            "count": {"$add": [{"$ifNull": ["$count", 0]}, {"$ifNull": ["$backfilled_count", 0]}]}
+        }}
+    ]).to_list(None)
+    
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+    return [AuditLogRollup(**rollup) for rollup in rollups]
+
 # Contacts
 @api_router.post("/contacts")
 async def add_contact(contact_data: ContactAdd, current_user: User = Depends(get_current_user)):
@@ -381,31 +1545,75 @@ async def add_contact(contact_data: ContactAdd, current_user: User = Depends(get
         "contact_id": contact_data.contact_id,
         "added_at": datetime.now(timezone.utc).isoformat()
     })
+    await db.users.update_one({"id": current_user.id}, {"$inc": {"contacts_version": 1}})
+    contacts_cache.invalidate(current_user.id)
     
     return {"message": "Contact added successfully"}
 
 @api_router.get("/contacts", response_model=List[User])
-async def get_contacts(current_user: User = Depends(get_current_user)):
-    contacts = await db.contacts.find(
-        {"user_id": current_user.id},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    contact_ids = [c["contact_id"] for c in contacts]
-    
-    if not contact_ids:
-        return []
-    
-    users = await db.users.find(
-        {"id": {"$in": contact_ids}},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(1000)
+async def get_contacts(
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(CONTACTS_PAGE_SIZE, ge=1, le=MAX_CONTACTS_PAGE_SIZE),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Return a page of the user's contacts. The total number of contacts is sent
+    in the X-Total-Count header so clients can page past the first batch.
+    """
+    contacts_version = stored_version(request, "contacts_version")
+    etag = make_etag(("contacts", current_user.id), contacts_version, skip, limit)
+    if etag_matches(request, etag):
+        return not_modified(etag, REVALIDATE_CACHE_CONTROL)
     
-    for user in users:
-        if isinstance(user.get('created_at'), str):
-            user['created_at'] = datetime.fromisoformat(user['created_at'])
+    # Keying on the stored version keeps other workers' caches from serving a stale list.
+    # Only the pages the client walks through are cached, so arbitrary skip/limit
+    # combinations cannot fill the cache with overlapping copies of one contact list
+    cacheable = limit == CONTACTS_PAGE_SIZE and skip % limit == 0
+    cached = contacts_cache.get(current_user.id, (skip, limit, contacts_version)) if cacheable else None
+    if cached is None:
+        # One round-trip: count and page the contacts, then join the user documents
+        result = await db.contacts.aggregate([
+            {"$match": {"user_id": current_user.id}},
+            {"$sort": {"added_at": 1, "contact_id": 1}},
+            {"$facet": {
+                "total": [{"$count": "count"}],
+                "users": [
+                    {"$skip": skip},
+                    {"$limit": limit},
+                    {"$lookup": {
+                        "from": "users",
+                        "localField": "contact_id",
+                        "foreignField": "id",
+                        "as": "user"
+                    }},
+                    {"$unwind": "$user"},
+                    {"$replaceRoot": {"newRoot": "$user"}},
+                    {"$project": {
+                        "_id": 0,
+                        "id": 1,
+                        "username": 1,
+                        "email": 1,
+                        "public_key": 1,
+                        "created_at": 1
+                    }}
+                ]
+            }}
+        ]).to_list(1)
+        
+        page = result[0] if result else {"total": [], "users": []}
+        total = page["total"][0]["count"] if page["total"] else 0
+        cached = (total, page["users"])
+        if cacheable:
+            contacts_cache.set(current_user.id, (skip, limit, contacts_version), cached, size=max(len(page["users"]), 1))
     
-    return [User(**user) for user in users]
+    total, users = cached
+    # Documents are already in the User shape with ISO timestamps, so skip re-validation
+    return JSONResponse(content=users, headers={
+        "X-Total-Count": str(total),
+        "ETag": etag,
+        "Cache-Control": REVALIDATE_CACHE_CONTROL
+    })
 
 # Socket.IO events
 @sio.event
@@ -414,7 +1622,10 @@ async def connect(sid, environ, auth):
         try:
             payload = jwt.decode(auth['token'], SECRET_KEY, algorithms=[ALGORITHM])
             user_id = payload.get('sub')
+            await sio.save_session(sid, {'user_id': user_id})
             await sio.enter_room(sid, user_id)
+            for group_id in await db.group_members.distinct("group_id", {"user_id": user_id}):
+                await sio.enter_room(sid, group_room(group_id))
             await sio.emit('connected', {'status': 'success'}, room=sid)
             logging.info(f"User {user_id} connected with sid {sid}")
         except jwt.PyJWTError:
@@ -428,23 +1639,146 @@ async def disconnect(sid):
 
 @sio.event
 async def typing(sid, data):
+    # Typing indicators are best-effort, so throttled or shed events are dropped silently
+    session = await sio.get_session(sid)
+    user_id = session.get('user_id')
+    if not user_id or load_monitor.overloaded() or rate_limiter.acquire(user_id, 'typing'):
+        return
+    
     receiver_id = data.get('receiver_id')
     if receiver_id:
-        await sio.emit('user_typing', {'sender_id': data.get('sender_id')}, room=receiver_id)
+        # The authenticated user, never a client-supplied sender_id
+        await sio.emit('user_typing', {'sender_id': user_id}, room=receiver_id)
+
+class ShedLoadMiddleware:
+    """
+    Plain ASGI middleware that answers 429 while the server is overloaded.
+    Unlike @app.middleware("http") it adds no per-request task and leaves
+    streamed response bodies untouched.
+    """
 
-# Include router
-app.include_router(api_router)
+    def __init__(self, app):
+        self.app = app
 
-# Wrap Socket.IO with ASGI
-socket_app = socketio.ASGIApp(sio, app)
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        # The API root stays available so health checks don't flap while shedding
+        if scope["type"] == "http" and path.startswith("/api/") and path != "/api/" and load_monitor.overloaded():
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Server is overloaded, please retry"},
+                headers={"Retry-After": str(LOAD_SHED_RETRY_AFTER_SECONDS)}
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+async def create_indexes():
+    await db.users.create_index("id", unique=True)
+    await db.contacts.create_index([("user_id", 1), ("added_at", 1), ("contact_id", 1)])
+    await db.contacts.create_index("contact_id")
+    await db.messages.create_index([("conversation_id", 1), ("timestamp", 1)])
+    await db.groups.create_index("id", unique=True)
+    await db.group_members.create_index([("group_id", 1), ("user_id", 1)], unique=True)
+    await db.group_members.create_index("user_id")
+    await db.attachments.create_index("id", unique=True)
+    await db.attachments.create_index("owner_id")
+    await db.attachments.create_index("grants_expire_at", sparse=True)
+    await db.messages.create_index("timestamp")
+    await db.messages.create_index("expires_at", expireAfterSeconds=0)
+    await db.conversation_settings.create_index("conversation_id", unique=True)
+    try:
+        await db.create_collection(
+            "messages_archive",
+            storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}}
+        )
+    except CollectionInvalid:
+        pass
+    await db.messages_archive.create_index([("conversation_id", 1), ("timestamp", 1)])
+    # Account deletion removes a user's archived messages by sender and by receiver
+    await db.messages_archive.create_index("sender_id")
+    await db.messages_archive.create_index("receiver_id", sparse=True)
+    await db.audit_logs.create_index([("user_id", 1), ("timestamp", -1), ("id", -1)])
+    await db.audit_logs.create_index([("user_id", 1), ("event_type", 1), ("timestamp", -1), ("id", -1)])
+    await db.audit_logs.create_index([("user_id", 1), ("chat_id", 1), ("timestamp", -1), ("id", -1)])
+    await db.audit_rollups.create_index(
+        [("user_id", 1), ("granularity", 1), ("bucket", 1), ("event_type", 1)],
+        unique=True
+    )
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """
+    Build the API app. Nothing touches the network until the lifespan runs,
+    which opens the Mongo pool, warms it, ensures indexes and starts the
+    background tasks, then tears all of it down on shutdown.
+
+    Routes, background tasks and socket handlers share module-level state
+    (the Mongo client, caches, limiter, tunables), so this runs once per
+    process: `app` below is built at import from the environment, and any
+    further call raises rather than building a second app on the same state.
+    """
+    global SECRET_KEY, app_settings, contacts_cache
+    global EVENT_LOOP_LAG_THRESHOLD_MS, MONGO_LATENCY_THRESHOLD_MS, ATTACHMENTS_DIR, ATTACHMENT_MAX_BYTES
+    global ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL_SECONDS
+    if app_settings is not None:
+        raise RuntimeError("create_app has already configured this process; use server.app")
+    settings = settings or Settings.from_env()
+    app_settings = settings
+    SECRET_KEY = settings.jwt_secret_key
+    contacts_cache = TTLCache(settings.contacts_cache_ttl_seconds, max_size=CONTACTS_CACHE_MAX_DOCUMENTS)
+    EVENT_LOOP_LAG_THRESHOLD_MS = settings.event_loop_lag_threshold_ms
+    MONGO_LATENCY_THRESHOLD_MS = settings.mongo_latency_threshold_ms
+    ATTACHMENTS_DIR = settings.attachments_dir
+    ATTACHMENT_MAX_BYTES = settings.attachment_max_bytes
+    ARCHIVE_AFTER_DAYS = settings.archive_after_days
+    ARCHIVE_INTERVAL_SECONDS = settings.archive_interval_seconds
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        global client, db
+        client = AsyncIOMotorClient(
+            settings.mongo_url,
+            maxPoolSize=settings.mongo_max_pool_size,
+            minPoolSize=settings.mongo_min_pool_size,
+            compressors=settings.mongo_compressors,
+            serverSelectionTimeoutMS=settings.mongo_server_selection_timeout_ms,
+            connectTimeoutMS=settings.mongo_connect_timeout_ms,
+            socketTimeoutMS=settings.mongo_socket_timeout_ms,
+        )
+        db = client[settings.db_name]
+        
+        # Concurrent pings open min_pool_size connections before the first request needs them
+        await asyncio.gather(*(db.command("ping") for _ in range(max(settings.mongo_min_pool_size, 1))))
+        await create_indexes()
+        
+        run_in_background(load_monitor.watch_event_loop())
+        run_in_background(load_monitor.watch_mongo())
+        run_in_background(backfill_conversation_ids())
+        run_in_background(archive_old_messages())
+        run_in_background(expire_attachments())
+        run_in_background(sweep_caches())
+        run_in_background(backfill_audit_rollups(cutoff=datetime.now(timezone.utc)))
+        try:
+            yield
+        finally:
+            for task in background_tasks:
+                task.cancel()
+            await asyncio.gather(*background_tasks, return_exceptions=True)
+            background_tasks.clear()
+            client.close()
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(api_router)
+    app.add_middleware(ShedLoadMiddleware)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=settings.cors_origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Total-Count", "X-Next-Cursor", "ETag", "Retry-After", "Content-Range", "Accept-Ranges"],
+    )
+    return app
 
 logging.basicConfig(
     level=logging.INFO,
@@ -452,10 +1786,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+# Create the main app
+app = create_app()
+
+# Wrap Socket.IO with ASGI
+socket_app = socketio.ASGIApp(sio, app)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(socket_app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    uvicorn.run(socket_app, host="0.0.0.0", port=8001)
@@ -0,0 +1,29 @@
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import server  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = AsyncMongoMockClient()["secure_chat_test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+@pytest.fixture
+def make_user():
+    def factory(user_id="user-1"):
+        return server.User(
+            id=user_id,
+            username=f"name-{user_id}",
+            email=f"{user_id}@example.com",
+            public_key="key",
+            created_at=datetime.now(timezone.utc)
+        )
+    return factory
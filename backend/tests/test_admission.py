@@ -0,0 +1,115 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import server
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def idle_monitor(monkeypatch):
+    monitor = server.LoadMonitor()
+    monkeypatch.setattr(server, "load_monitor", monitor)
+    return monitor
+
+
+def test_bucket_allows_burst_then_reports_wait(clock):
+    limiter = server.TokenBucketLimiter({"route": (2.0, 3)})
+    assert [limiter.acquire("u", "route") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("u", "route") == pytest.approx(0.5)
+
+
+def test_bucket_refills_at_rate_and_caps_at_burst(clock):
+    limiter = server.TokenBucketLimiter({"route": (2.0, 3)})
+    for _ in range(3):
+        limiter.acquire("u", "route")
+
+    clock.now += 0.5
+    assert limiter.acquire("u", "route") == 0.0
+    assert limiter.acquire("u", "route") > 0
+
+    clock.now += 100
+    assert [limiter.acquire("u", "route") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("u", "route") > 0
+
+
+def test_buckets_are_per_user_and_route(clock):
+    limiter = server.TokenBucketLimiter({"a": (1.0, 1), "b": (1.0, 1)})
+    assert limiter.acquire("u1", "a") == 0.0
+    assert limiter.acquire("u1", "a") > 0
+    assert limiter.acquire("u2", "a") == 0.0
+    assert limiter.acquire("u1", "b") == 0.0
+
+
+def test_prune_drops_only_refilled_buckets(clock):
+    limiter = server.TokenBucketLimiter({"route": (1.0, 2)})
+    limiter.acquire("u", "route")
+    limiter.acquire("u", "route")
+
+    clock.now += 1
+    limiter.prune()
+    assert ("u", "route") in limiter._buckets
+
+    clock.now += 1
+    limiter.prune()
+    assert limiter._buckets == {}
+
+
+def test_rate_limited_dependency_sets_retry_after(clock, monkeypatch, make_user):
+    monkeypatch.setattr(server, "rate_limiter", server.TokenBucketLimiter({"search_users": (0.25, 1)}))
+    dependency = server.rate_limited("search_users")
+    user = make_user()
+
+    assert asyncio.run(dependency(current_user=user)) is user
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(dependency(current_user=user))
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.headers["Retry-After"] == "4"
+
+
+def test_shed_load_rejects_api_requests_when_overloaded(idle_monitor):
+    client = TestClient(server.app)
+    idle_monitor.event_loop_lag_ms = server.EVENT_LOOP_LAG_THRESHOLD_MS + 1
+
+    response = client.get("/api/users/search", params={"q": "ab"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(server.LOAD_SHED_RETRY_AFTER_SECONDS)
+
+    # The API root stays up for health checks
+    assert client.get("/api/").status_code == 200
+
+
+def test_shed_load_on_mongo_latency(idle_monitor):
+    idle_monitor.mongo_latency_ms = server.MONGO_LATENCY_THRESHOLD_MS + 1
+    assert idle_monitor.overloaded()
+
+    idle_monitor.mongo_latency_ms = 0
+    assert not idle_monitor.overloaded()
+
+
+def test_typing_emits_session_user(monkeypatch, idle_monitor):
+    monkeypatch.setattr(server, "rate_limiter", server.TokenBucketLimiter(server.RATE_LIMITS))
+    monkeypatch.setattr(server.sio, "get_session", AsyncMock(return_value={"user_id": "user-1"}))
+    emit = AsyncMock()
+    monkeypatch.setattr(server.sio, "emit", emit)
+
+    asyncio.run(server.typing("sid", {"receiver_id": "user-2", "sender_id": "spoofed"}))
+
+    emit.assert_awaited_once_with("user_typing", {"sender_id": "user-1"}, room="user-2")
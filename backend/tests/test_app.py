@@ -0,0 +1,34 @@
+from pathlib import Path
+
+import pytest
+
+import server
+
+
+def test_create_app_runs_once_per_process():
+    settings, secret_key = server.app_settings, server.SECRET_KEY
+
+    with pytest.raises(RuntimeError):
+        server.create_app(settings.model_copy())
+    with pytest.raises(RuntimeError):
+        server.create_app(settings.model_copy(update={"jwt_secret_key": "other"}))
+    assert (server.app_settings, server.SECRET_KEY) == (settings, secret_key)
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv("MONGO_URL", "mongodb://db:27017")
+    monkeypatch.setenv("DB_NAME", "chat")
+    monkeypatch.setenv("CORS_ORIGINS", "https://a.example,https://b.example")
+    monkeypatch.setenv("ATTACHMENTS_DIR", "/srv/attachments")
+    monkeypatch.setenv("EVENT_LOOP_LAG_THRESHOLD_MS", "100")
+    monkeypatch.delenv("ARCHIVE_AFTER_DAYS", raising=False)
+
+    settings = server.Settings.from_env()
+    assert settings.cors_origins == ["https://a.example", "https://b.example"]
+    assert settings.attachments_dir == Path("/srv/attachments")
+    assert settings.event_loop_lag_threshold_ms == 100.0
+    assert settings.archive_after_days == 90
+
+
+def test_default_compressors_need_no_extra_packages():
+    assert server.Settings.model_fields["mongo_compressors"].default == "zlib"
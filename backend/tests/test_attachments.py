@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+class ChunkedRequest:
+    """Stands in for a Request whose body arrives in several pieces."""
+
+    def __init__(self, *chunks, delay=0.0):
+        self.chunks = chunks
+        self.delay = delay
+
+    async def stream(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(self.delay)
+            yield chunk
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "ATTACHMENTS_DIR", tmp_path)
+    return tmp_path
+
+
+def create(make_user, size):
+    return asyncio.run(server.create_attachment(server.AttachmentCreate(size=size), current_user=make_user("alice")))
+
+
+def test_parse_range():
+    assert server.parse_range("bytes=2-5", 10) == (2, 5)
+    assert server.parse_range("bytes=4-", 10) == (4, 9)
+    assert server.parse_range("bytes=-3", 10) == (7, 9)
+    assert server.parse_range("bytes=5-100", 10) == (5, 9)
+    assert server.parse_range("bytes=10-", 10) is None
+    assert server.parse_range("bytes=0-1,3-4", 10) is None
+    assert server.parse_range("items=0-1", 10) is None
+
+
+def test_resumable_upload(db, storage, make_user):
+    alice = make_user("alice")
+    attachment = create(make_user, 10)
+
+    partial = asyncio.run(server.upload_attachment_chunk(attachment.id, ChunkedRequest(b"01", b"23"), 0, current_user=alice))
+    assert (partial.received, partial.status) == (4, "uploading")
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(server.upload_attachment_chunk(attachment.id, ChunkedRequest(b"xx"), 0, current_user=alice))
+    assert exc_info.value.status_code == 409
+
+    done = asyncio.run(server.upload_attachment_chunk(attachment.id, ChunkedRequest(b"456789"), 4, current_user=alice))
+    assert (done.received, done.status) == (10, "complete")
+    assert server.attachment_path(attachment.id).read_bytes() == b"0123456789"
+    assert list(storage.glob("*.part")) == []
+
+
+def test_chunk_larger_than_declared_size_is_rejected(db, storage, make_user):
+    attachment = create(make_user, 3)
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(server.upload_attachment_chunk(
+            attachment.id, ChunkedRequest(b"abcd"), 0, current_user=make_user("alice")
+        ))
+    assert exc_info.value.status_code == 400
+    assert server.attachment_path(attachment.id).read_bytes() == b""
+
+
+def test_concurrent_chunks_at_same_offset_do_not_interleave(db, storage, make_user):
+    alice = make_user("alice")
+    attachment = create(make_user, 4)
+
+    async def race():
+        return await asyncio.gather(
+            server.upload_attachment_chunk(attachment.id, ChunkedRequest(b"aa", b"aa", delay=0.01), 0, current_user=alice),
+            server.upload_attachment_chunk(attachment.id, ChunkedRequest(b"bb", b"bb", delay=0.01), 0, current_user=alice),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(race())
+    winners = [result for result in results if isinstance(result, server.Attachment)]
+    losers = [result for result in results if isinstance(result, HTTPException)]
+    assert len(winners) == 1 and len(losers) == 1
+    assert losers[0].status_code == 409
+    assert server.attachment_path(attachment.id).read_bytes() in (b"aaaa", b"bbbb")
@@ -0,0 +1,162 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException, Response
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+
+
+def request_for(db, user_id, headers=None):
+    user_doc = asyncio.run(db.users.find_one({"id": user_id}, {"_id": 0})) or {"id": user_id}
+    return SimpleNamespace(headers=headers or {}, state=SimpleNamespace(user_doc=user_doc))
+
+
+def log(log_id, timestamp, event_type="login", chat_id=None, user_id="alice"):
+    return {
+        "id": log_id,
+        "user_id": user_id,
+        "event_type": event_type,
+        "chat_id": chat_id,
+        "device_info": None,
+        "timestamp": timestamp
+    }
+
+
+def list_logs(db, user, **params):
+    response = Response()
+    logs = asyncio.run(server.get_audit_logs(
+        request_for(db, user.id),
+        response,
+        **{"limit": server.AUDIT_LOGS_PAGE_SIZE, "cursor": None, "event_type": None, "chat_id": None, **params},
+        current_user=user
+    ))
+    return [entry.id for entry in logs], response.headers.get("X-Next-Cursor")
+
+
+def summary(db, user, headers=None, **params):
+    response = Response()
+    result = asyncio.run(server.get_audit_log_summary(
+        request_for(db, user.id, headers),
+        response,
+        **{"granularity": "day", "since": None, "until": None, "event_type": None, **params},
+        current_user=user
+    ))
+    return result, response
+
+
+def test_ingest_counts_into_rollups_and_bumps_version(db, make_user):
+    alice = make_user("alice")
+    asyncio.run(db.users.insert_one({"id": "alice"}))
+    for event_type in ("login", "login", "logout"):
+        asyncio.run(server.create_audit_log(server.AuditLogCreate(event_type=event_type), current_user=alice))
+
+    rollups = asyncio.run(db.audit_rollups.find({"granularity": "hour"}, {"_id": 0, "event_type": 1, "count": 1}).to_list(None))
+    assert sorted((r["event_type"], r["count"]) for r in rollups) == [("login", 2), ("logout", 1)]
+    assert asyncio.run(db.audit_rollups.count_documents({"granularity": "day"})) == 2
+    assert asyncio.run(db.users.find_one({"id": "alice"}))["audit_logs_version"] == 3
+
+    counts, _ = summary(db, alice)
+    assert sorted((r.event_type, r.count) for r in counts) == [("login", 2), ("logout", 1)]
+
+
+def test_cursor_pages_through_ties_without_gaps(db, make_user):
+    alice = make_user("alice")
+    # Two logs share a timestamp, so the cursor must also order by id
+    asyncio.run(db.audit_logs.insert_many([
+        log("a", "2026-01-01T00:00:01+00:00"),
+        log("b", "2026-01-01T00:00:02+00:00"),
+        log("c", "2026-01-01T00:00:02+00:00"),
+        log("d", "2026-01-01T00:00:03+00:00"),
+        log("e", "2026-01-01T00:00:04+00:00"),
+        log("x", "2026-01-01T00:00:05+00:00", user_id="bob")
+    ]))
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = list_logs(db, alice, limit=2, cursor=cursor)
+        seen += page
+        if not cursor:
+            break
+    assert seen == ["e", "d", "c", "b", "a"]
+
+
+def test_filters_by_event_type_and_chat(db, make_user):
+    alice = make_user("alice")
+    asyncio.run(db.audit_logs.insert_many([
+        log("a", "2026-01-01T00:00:01+00:00", "screenshot", "chat-1"),
+        log("b", "2026-01-01T00:00:02+00:00", "screenshot", "chat-2"),
+        log("c", "2026-01-01T00:00:03+00:00", "login")
+    ]))
+
+    assert list_logs(db, alice, event_type="screenshot")[0] == ["b", "a"]
+    assert list_logs(db, alice, chat_id="chat-1")[0] == ["a"]
+    assert list_logs(db, alice, event_type="login", chat_id="chat-1")[0] == []
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "bm8tc2VwYXJhdG9y", "__8="])
+def test_invalid_cursor_is_rejected(db, make_user, cursor):
+    with pytest.raises(HTTPException) as exc_info:
+        list_logs(db, make_user("alice"), cursor=cursor)
+    assert exc_info.value.status_code == 400
+
+
+def test_summary_reads_naive_window_as_utc(db, make_user):
+    alice = make_user("alice")
+    asyncio.run(db.audit_rollups.insert_many([
+        {"user_id": "alice", "granularity": "hour", "bucket": "2026-01-01T10", "event_type": "login", "count": 1},
+        {"user_id": "alice", "granularity": "hour", "bucket": "2026-01-01T11", "event_type": "login", "backfilled_count": 2}
+    ]))
+    naive = {"granularity": "hour", "since": datetime(2026, 1, 1, 11), "until": datetime(2026, 1, 1, 12)}
+    aware = {key: value.replace(tzinfo=timezone.utc) if isinstance(value, datetime) else value for key, value in naive.items()}
+    shifted = {**aware, "since": datetime(2026, 1, 1, 13, tzinfo=timezone(timedelta(hours=2)))}
+
+    naive_counts, naive_response = summary(db, alice, **naive)
+    aware_counts, aware_response = summary(db, alice, **aware)
+    shifted_counts, shifted_response = summary(db, alice, **shifted)
+    assert [(r.bucket, r.count) for r in naive_counts] == [("2026-01-01T11", 2)]
+    assert naive_counts == aware_counts == shifted_counts
+    assert naive_response.headers["ETag"] == aware_response.headers["ETag"] == shifted_response.headers["ETag"]
+
+
+# $merge is not supported by mongomock, so the backfill runs against a real
+# server when TEST_MONGO_URL is set and is skipped otherwise.
+@pytest.mark.skipif(not os.environ.get("TEST_MONGO_URL"), reason="needs a MongoDB server in TEST_MONGO_URL")
+def test_backfill_is_idempotent_and_invalidates_summaries(monkeypatch, make_user):
+    async def scenario():
+        mongo = AsyncIOMotorClient(os.environ["TEST_MONGO_URL"])
+        database = mongo[f"audit_backfill_{os.getpid()}"]
+        monkeypatch.setattr(server, "db", database)
+        try:
+            await database.users.insert_one({"id": "alice", "audit_logs_version": 1})
+            await database.audit_logs.insert_many([
+                log("a", "2026-01-01T10:00:00+00:00"),
+                log("b", "2026-01-01T10:30:00+00:00"),
+                log("c", "2026-01-02T09:00:00+00:00", "logout")
+            ])
+            # One of the old logs was also counted at ingest after the cutoff was fixed
+            await database.audit_rollups.insert_one(
+                {"user_id": "alice", "granularity": "day", "bucket": "2026-01-01", "event_type": "login", "count": 1}
+            )
+            cutoff = datetime(2026, 1, 3, tzinfo=timezone.utc)
+
+            await server.backfill_audit_rollups(cutoff)
+            # An interrupted run is retried from the start and must not double count
+            await database.migrations.update_one({"name": "audit_rollups"}, {"$unset": {"completed": ""}})
+            await server.backfill_audit_rollups(cutoff)
+
+            rollups = await database.audit_rollups.find({"granularity": "day"}, {"_id": 0}).to_list(None)
+            counts = {
+                (r["bucket"], r["event_type"]): (r.get("count", 0), r.get("backfilled_count", 0))
+                for r in rollups
+            }
+            assert counts == {("2026-01-01", "login"): (1, 2), ("2026-01-02", "logout"): (0, 1)}
+            assert (await database.users.find_one({"id": "alice"}))["audit_logs_version"] == 3
+        finally:
+            await mongo.drop_database(database.name)
+            mongo.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def contacts_cache(monkeypatch):
+    cache = server.TTLCache(server.app_settings.contacts_cache_ttl_seconds, max_size=server.CONTACTS_CACHE_MAX_DOCUMENTS)
+    monkeypatch.setattr(server, "contacts_cache", cache)
+    return cache
+
+
+def get_contacts(user, skip, limit):
+    request = SimpleNamespace(headers={}, state=SimpleNamespace(user_doc={"id": user.id}))
+    return asyncio.run(server.get_contacts(request, skip=skip, limit=limit, current_user=user))
+
+
+def test_cache_evicts_least_recently_used_past_max_size():
+    cache = server.TTLCache(60, max_entries=10, max_size=5)
+    cache.set("a", 1, "one", size=2)
+    cache.set("b", 1, "two", size=2)
+    assert cache.get("a", 1) == "one"
+
+    cache.set("c", 1, "three", size=2)
+    assert cache.get("b", 1) is None
+    assert (cache.get("a", 1), cache.get("c", 1), cache.size) == ("one", "three", 4)
+
+    # Replacing an entry releases its old size, and oversized values are not cached
+    cache.set("a", 1, "uno", size=1)
+    cache.set("d", 1, "huge", size=6)
+    assert (cache.get("d", 1), cache.size) == (None, 3)
+
+    cache.invalidate("a", "c")
+    assert (cache.size, cache._scopes) == (0, {})
+
+
+def test_only_canonical_contact_pages_are_cached(db, make_user, contacts_cache):
+    user = make_user("alice")
+    now = datetime.now(timezone.utc).isoformat()
+    asyncio.run(db.users.insert_many([
+        {"id": f"c{i}", "username": f"c{i}", "email": f"c{i}@example.com", "public_key": "key", "created_at": now}
+        for i in range(3)
+    ]))
+    asyncio.run(db.contacts.insert_many([
+        {"user_id": "alice", "contact_id": f"c{i}", "added_at": now} for i in range(3)
+    ]))
+
+    for skip in range(3):
+        assert get_contacts(user, skip, 1).status_code == 200
+    get_contacts(user, 1, server.CONTACTS_PAGE_SIZE)
+    assert contacts_cache.size == 0
+
+    response = get_contacts(user, 0, server.CONTACTS_PAGE_SIZE)
+    assert response.headers["X-Total-Count"] == "3"
+    assert contacts_cache.size == 3
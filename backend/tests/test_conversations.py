@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+def legacy_message(message_id, sender_id, receiver_id, timestamp):
+    # Shape of messages written before conversation_id existed
+    return {
+        "id": message_id,
+        "sender_id": sender_id,
+        "receiver_id": receiver_id,
+        "encrypted_content": "ciphertext",
+        "iv": "iv",
+        "sender_public_key": "key",
+        "timestamp": timestamp,
+        "is_delivered": False,
+        "is_read": False
+    }
+
+
+@pytest.fixture
+def backfill_pending(monkeypatch):
+    monkeypatch.setattr(server, "conversation_backfill_done", False)
+
+
+def test_conversation_id_is_symmetric():
+    assert server.conversation_id_for("alice", "bob") == server.conversation_id_for("bob", "alice")
+    assert server.conversation_id_for("alice", "bob") != server.conversation_id_for("alice", "carol")
+
+
+def test_history_complete_before_and_after_backfill(db, make_user, backfill_pending):
+    asyncio.run(db.messages.insert_many([
+        legacy_message("m1", "alice", "bob", "2026-01-01T00:00:01+00:00"),
+        legacy_message("m2", "bob", "alice", "2026-01-01T00:00:02+00:00"),
+        legacy_message("m3", "alice", "bob", "2026-01-01T00:00:03+00:00"),
+        legacy_message("other", "alice", "carol", "2026-01-01T00:00:04+00:00"),
+    ]))
+    alice = make_user("alice")
+
+    before = asyncio.run(server.get_messages("bob", current_user=alice))
+    assert [msg.id for msg in before] == ["m1", "m2", "m3"]
+
+    asyncio.run(server.backfill_conversation_ids(batch_size=2))
+    assert server.conversation_backfill_done
+
+    after = asyncio.run(server.get_messages("bob", current_user=alice))
+    assert [msg.id for msg in after] == ["m1", "m2", "m3"]
+    assert {msg.conversation_id for msg in after} == {server.conversation_id_for("alice", "bob")}
+
+    migration = asyncio.run(db.migrations.find_one({"name": "conversation_id"}))
+    assert migration["completed"]
+
+
+def test_backfill_resumes_after_last_processed_id(db, backfill_pending):
+    asyncio.run(db.messages.insert_many([
+        legacy_message(f"m{i}", "alice", "bob", f"2026-01-01T00:00:0{i}+00:00") for i in range(4)
+    ]))
+    docs = asyncio.run(db.messages.find({}).sort("_id", 1).to_list(None))
+    # A previous run stopped after the second message
+    asyncio.run(db.migrations.insert_one({"name": "conversation_id", "last_id": docs[1]["_id"]}))
+
+    asyncio.run(server.backfill_conversation_ids(batch_size=1))
+
+    stamped = asyncio.run(db.messages.find({"conversation_id": {"$exists": True}}).to_list(None))
+    # Only messages after last_id are visited on resume
+    assert sorted(msg["id"] for msg in stamped) == ["m2", "m3"]
+    migration = asyncio.run(db.migrations.find_one({"name": "conversation_id"}))
+    assert migration["completed"]
+    assert migration["last_id"] == docs[3]["_id"]
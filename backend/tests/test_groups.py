@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi import HTTPException, Response
+
+import server
+
+
+@pytest.fixture
+def emit(monkeypatch):
+    emit = AsyncMock()
+    monkeypatch.setattr(server.sio, "emit", emit)
+    return emit
+
+
+@pytest.fixture
+def group(db, make_user, emit):
+    asyncio.run(db.users.insert_many([
+        {"id": user_id, "username": user_id, "email": f"{user_id}@example.com", "public_key": "key"}
+        for user_id in ("alice", "bob", "carol")
+    ]))
+    return asyncio.run(server.create_group(
+        server.GroupCreate(name="team", member_ids=["bob", "carol"]),
+        current_user=make_user("alice")
+    ))
+
+
+def admins(db, group_id):
+    return asyncio.run(db.group_members.distinct("user_id", {"group_id": group_id, "role": "admin"}))
+
+
+def test_create_group_rejects_unknown_members(db, make_user, emit):
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(server.create_group(
+            server.GroupCreate(name="team", member_ids=["ghost"]),
+            current_user=make_user("alice")
+        ))
+    assert exc_info.value.status_code == 400
+
+
+def test_group_message_is_stored_once_and_emitted_once(db, group, make_user, emit):
+    emit.reset_mock()
+    message = asyncio.run(server.send_group_message(
+        group.id,
+        server.GroupMessageCreate(encrypted_content="ciphertext", iv="iv", sender_public_key="key"),
+        current_user=make_user("bob")
+    ))
+
+    assert asyncio.run(db.messages.count_documents({"group_id": group.id})) == 1
+    emit.assert_awaited_once()
+    assert emit.await_args.kwargs["room"] == server.group_room(group.id)
+
+    history = asyncio.run(server.get_group_messages(group.id, current_user=make_user("carol")))
+    assert [msg.id for msg in history] == [message.id]
+
+
+def test_non_members_cannot_read_or_send(db, group, make_user):
+    outsider = make_user("mallory")
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(server.get_group_messages(group.id, current_user=outsider))
+    assert exc_info.value.status_code == 404
+
+
+def test_read_cursor_is_clamped_to_now(db, group, make_user):
+    future = datetime.now(timezone.utc) + timedelta(days=365)
+    result = asyncio.run(server.mark_group_read(
+        group.id,
+        server.GroupReadCursor(timestamp=future),
+        current_user=make_user("bob")
+    ))
+
+    assert datetime.fromisoformat(result["last_read_at"]) <= datetime.now(timezone.utc)
+    member = asyncio.run(db.group_members.find_one({"group_id": group.id, "user_id": "bob"}))
+    assert member["last_read_at"] == result["last_read_at"]
+
+
+def test_last_admin_leaving_promotes_a_member(db, group, make_user):
+    asyncio.run(server.remove_group_member(group.id, "alice", current_user=make_user("alice")))
+
+    remaining_admins = admins(db, group.id)
+    assert len(remaining_admins) == 1
+    assert remaining_admins[0] in ("bob", "carol")
+
+
+def test_members_cannot_remove_others(db, group, make_user):
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(server.remove_group_member(group.id, "carol", current_user=make_user("bob")))
+    assert exc_info.value.status_code == 403
+    assert admins(db, group.id) == ["alice"]
+
+
+def test_groups_are_paged_with_total(db, make_user, emit):
+    asyncio.run(db.users.insert_one({"id": "alice", "username": "alice", "email": "alice@example.com", "public_key": "key"}))
+    alice = make_user("alice")
+    for name in ("one", "two", "three"):
+        asyncio.run(server.create_group(server.GroupCreate(name=name, member_ids=[]), current_user=alice))
+
+    seen = []
+    for skip in (0, 2):
+        response = Response()
+        page = asyncio.run(server.get_groups(response, skip=skip, limit=2, current_user=alice))
+        assert response.headers["X-Total-Count"] == "3"
+        seen += [group.name for group in page]
+    assert sorted(seen) == ["one", "three", "two"]
+
+    group = asyncio.run(server.get_groups(Response(), skip=0, limit=1, current_user=alice))[0]
+    asyncio.run(server.mark_group_read(group.id, server.GroupReadCursor(timestamp=datetime.now(timezone.utc)), current_user=alice))
+    assert asyncio.run(server.get_groups(Response(), skip=0, limit=1, current_user=alice))[0].last_read_at is not None
@@ -0,0 +1,169 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pydantic
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+@pytest.fixture
+def emit(monkeypatch):
+    emit = AsyncMock()
+    monkeypatch.setattr(server.sio, "emit", emit)
+    return emit
+
+
+def message(msg_id, minutes_ago, expires_at=None):
+    return {
+        "id": msg_id,
+        "conversation_id": "alice:bob",
+        "sender_id": "alice",
+        "receiver_id": "bob",
+        "timestamp": (datetime.now(timezone.utc) - timedelta(minutes=minutes_ago)).isoformat(),
+        "expires_at": expires_at
+    }
+
+
+def history(limit=server.HISTORY_LIMIT):
+    messages = asyncio.run(server.find_conversation_history({"conversation_id": "alice:bob"}, limit))
+    return [msg["id"] for msg in messages]
+
+
+def set_retention(conversation_id, ttl_seconds, user):
+    return asyncio.run(server.set_conversation_retention(
+        conversation_id,
+        server.RetentionUpdate(ttl_seconds=ttl_seconds),
+        current_user=user
+    ))
+
+
+def test_ttl_is_bounded():
+    with pytest.raises(pydantic.ValidationError):
+        server.RetentionUpdate(ttl_seconds=server.MAX_RETENTION_TTL_SECONDS + 1)
+    assert server.RetentionUpdate(ttl_seconds=server.MAX_RETENTION_TTL_SECONDS).ttl_seconds == server.MAX_RETENTION_TTL_SECONDS
+
+
+def test_stored_ttl_beyond_bound_is_clamped(db):
+    asyncio.run(db.conversation_settings.insert_one({"conversation_id": "alice:bob", "ttl_seconds": 10 ** 12}))
+    now = datetime.now(timezone.utc)
+    expires_at = asyncio.run(server.message_expiry("alice:bob", now))
+    assert expires_at == now + timedelta(seconds=server.MAX_RETENTION_TTL_SECONDS)
+
+
+@pytest.mark.parametrize("conversation_id", ["alice:bob:carol", "bob:carol", "bob:alice", "alice:"])
+def test_retention_rejects_malformed_conversation_ids(db, make_user, conversation_id):
+    with pytest.raises(HTTPException) as exc_info:
+        set_retention(conversation_id, 60, make_user("alice"))
+    assert exc_info.value.status_code == 400
+    assert asyncio.run(db.conversation_settings.count_documents({})) == 0
+
+
+def test_retention_applies_to_own_conversation(db, make_user):
+    assert set_retention("alice:bob", 60, make_user("bob")) == {"conversation_id": "alice:bob", "ttl_seconds": 60}
+
+
+def test_retention_change_applies_to_the_next_message(db, make_user):
+    now = datetime.now(timezone.utc)
+    assert asyncio.run(server.message_expiry("alice:bob", now)) is None
+
+    # Another worker turns retention on; this one must not keep using what it read before
+    asyncio.run(db.conversation_settings.insert_one({"conversation_id": "alice:bob", "ttl_seconds": 60}))
+    assert asyncio.run(server.message_expiry("alice:bob", now)) == now + timedelta(seconds=60)
+
+
+def test_history_hides_expired_messages(db):
+    now = datetime.now(timezone.utc)
+    asyncio.run(db.messages.insert_many([
+        message("expired", 3, expires_at=now - timedelta(seconds=1)),
+        message("expiring", 2, expires_at=now + timedelta(hours=1)),
+        message("kept", 1)
+    ]))
+
+    messages = asyncio.run(server.find_conversation_history({"conversation_id": "alice:bob"}))
+    assert [msg["id"] for msg in messages] == ["expiring", "kept"]
+    assert messages[0]["expires_at"].tzinfo is not None
+
+
+def test_history_reads_archive_only_to_fill_the_page(db):
+    asyncio.run(db.messages_archive.insert_many([message("a1", 50), message("a2", 40), message("h1", 30)]))
+    asyncio.run(db.messages.insert_many([message("h1", 30), message("h2", 20), message("h3", 10)]))
+
+    # Newest page, oldest first; h1 is in both collections after an interrupted archive batch
+    assert history(limit=4) == ["a2", "h1", "h2", "h3"]
+    assert history() == ["a1", "a2", "h1", "h2", "h3"]
+
+    asyncio.run(db.messages_archive.insert_one(message("stray", 5)))
+    assert history(limit=3) == ["h1", "h2", "h3"]
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "ATTACHMENTS_DIR", tmp_path)
+    return tmp_path
+
+
+def test_attachment_grant_lapses_with_disappearing_message(db, storage, make_user, emit):
+    alice, bob = make_user("alice"), make_user("bob")
+    asyncio.run(db.attachments.insert_one({"id": "file", "owner_id": "alice", "size": 1, "status": "complete", "grants": []}))
+    set_retention("alice:bob", 60, alice)
+
+    sent = asyncio.run(server.send_message(
+        server.MessageCreate(
+            receiver_id="bob",
+            encrypted_content="ciphertext",
+            iv="iv",
+            sender_public_key="key",
+            attachment_id="file"
+        ),
+        current_user=alice
+    ))
+    grant = asyncio.run(db.attachments.find_one({"id": "file"}))["grants"][0]
+    assert grant == {"user_id": "bob", "expires_at": sent.expires_at.isoformat()}
+
+    request = SimpleNamespace(headers={})
+    response = asyncio.run(server.download_attachment("file", request, current_user=bob))
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == server.REVALIDATE_CACHE_CONTROL
+
+    # Revalidation re-checks access, and answers 304 while it is still granted
+    revalidate = SimpleNamespace(headers={"if-none-match": response.headers["ETag"]})
+    assert asyncio.run(server.download_attachment("file", revalidate, current_user=bob)).status_code == 304
+
+    expired = (datetime.now(timezone.utc) - timedelta(seconds=1)).isoformat()
+    asyncio.run(db.attachments.update_one({"id": "file"}, {"$set": {"grants.0.expires_at": expired}}))
+    for req in (request, revalidate):
+        with pytest.raises(HTTPException) as exc_info:
+            asyncio.run(server.download_attachment("file", req, current_user=bob))
+        assert exc_info.value.status_code == 404
+
+
+def test_attachments_shared_only_by_expired_messages_are_deleted(db, storage):
+    past = (datetime.now(timezone.utc) - timedelta(seconds=1)).isoformat()
+    future = (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
+    asyncio.run(db.attachments.insert_many([
+        {"id": "expired", "owner_id": "alice", "status": "complete", "grants_expire_at": past},
+        {"id": "live", "owner_id": "alice", "status": "complete", "grants_expire_at": future},
+        {"id": "retained", "owner_id": "alice", "status": "complete", "grants_expire_at": past, "retained": True},
+        {"id": "unshared", "owner_id": "alice", "status": "complete"}
+    ]))
+    for attachment_id in ("expired", "live", "retained", "unshared"):
+        server.attachment_path(attachment_id).write_bytes(b"blob")
+
+    assert asyncio.run(server.delete_expired_attachments()) == 1
+    assert sorted(asyncio.run(db.attachments.distinct("id"))) == ["live", "retained", "unshared"]
+    assert sorted(path.name for path in storage.iterdir()) == ["live", "retained", "unshared"]
+
+
+def test_sharing_without_expiry_keeps_the_attachment(db, make_user):
+    asyncio.run(db.attachments.insert_one({"id": "file", "owner_id": "alice", "status": "complete", "grants": []}))
+    expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    asyncio.run(server.share_attachment("file", "alice", user_id="bob", expires_at=expires_at))
+    asyncio.run(server.share_attachment("file", "alice", user_id="carol"))
+
+    attachment = asyncio.run(db.attachments.find_one({"id": "file"}))
+    assert (attachment["grants_expire_at"], attachment["retained"]) == (expires_at.isoformat(), True)
+    assert asyncio.run(server.delete_expired_attachments()) == 0
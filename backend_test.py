@@ -17,13 +17,14 @@ class SecureChatAPITester:
         self.tests_run = 0
         self.tests_passed = 0
         self.test_results = []
+        self.last_response = None
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, headers=None):
-        """Run a single API test"""
+    def run_test(self, name, method, endpoint, expected_status, data=None, headers=None, body=None):
+        """Run a single API test (`body` sends raw bytes instead of JSON)"""
         url = f"{self.base_url}/{endpoint}" if not endpoint.startswith('http') else endpoint
         
         # Set default headers
-        request_headers = {'Content-Type': 'application/json'}
+        request_headers = {'Content-Type': 'application/octet-stream' if body is not None else 'application/json'}
         if headers:
             request_headers.update(headers)
         
@@ -40,10 +41,13 @@ class SecureChatAPITester:
                 response = requests.get(url, headers=request_headers, timeout=30)
             elif method == 'POST':
                 response = requests.post(url, json=data, headers=request_headers, timeout=30)
+            elif method == 'PUT' and body is not None:
+                response = requests.put(url, data=body, headers=request_headers, timeout=30)
             elif method == 'PUT':
                 response = requests.put(url, json=data, headers=request_headers, timeout=30)
             elif method == 'DELETE':
                 response = requests.delete(url, headers=request_headers, timeout=30)
+            self.last_response = response
 
             success = response.status_code == expected_status
             
@@ -92,6 +96,23 @@ class SecureChatAPITester:
             self.test_results.append(result)
             return False, {}
 
+    def check(self, name, condition, detail=""):
+        """Record a check on response content that run_test's status comparison can't express"""
+        self.tests_run += 1
+        print(f"\n🔍 Checking {name}...")
+        if condition:
+            self.tests_passed += 1
+            print("✅ Passed")
+        else:
+            print(f"❌ Failed - {detail}")
+        self.test_results.append({
+            'test_name': name,
+            'success': bool(condition),
+            'detail': detail,
+            'timestamp': datetime.now().isoformat()
+        })
+        return bool(condition)
+
     def test_api_root(self):
         """Test API root endpoint"""
         success, response = self.run_test(
@@ -194,6 +215,32 @@ class SecureChatAPITester:
         )
         return success, response
 
+    def test_get_user_not_modified(self, user_id):
+        """Test a repeated user lookup with the returned ETag answers 304"""
+        success, _ = self.run_test("Get User (for ETag)", "GET", f"users/{user_id}", 200)
+        if not success:
+            return False
+        etag = self.last_response.headers.get('ETag')
+        success, _ = self.run_test(
+            "Get User (If-None-Match)",
+            "GET",
+            f"users/{user_id}",
+            304,
+            headers={'If-None-Match': etag}
+        )
+        return success
+
+    def test_get_missing_user_with_wildcard_etag(self):
+        """Test If-None-Match: * doesn't mask a missing user"""
+        success, _ = self.run_test(
+            "Get Missing User (If-None-Match: *)",
+            "GET",
+            f"users/{uuid.uuid4()}",
+            404,
+            headers={'If-None-Match': '*'}
+        )
+        return success
+
     def test_send_message(self, receiver_id, encrypted_content="encrypted_test_message", iv="mock_iv"):
         """Test sending encrypted message"""
         success, response = self.run_test(
@@ -243,6 +290,106 @@ class SecureChatAPITester:
         )
         return success, response
 
+    def test_get_contacts_page(self, expected_ids):
+        """Test contacts are paged and the total is reported in X-Total-Count"""
+        success, first_page = self.run_test(
+            "Get Contacts (first page)",
+            "GET",
+            "contacts?skip=0&limit=1",
+            200
+        )
+        if not success:
+            return False
+        total = self.last_response.headers.get('X-Total-Count')
+        self.check(
+            "Contacts X-Total-Count",
+            total == str(len(expected_ids)),
+            f"expected {len(expected_ids)}, got {total}"
+        )
+
+        success, second_page = self.run_test(
+            "Get Contacts (second page)",
+            "GET",
+            "contacts?skip=1&limit=1",
+            200
+        )
+        seen = [c['id'] for c in first_page + (second_page if success else [])]
+        return self.check(
+            "Contacts paging covers every contact once",
+            sorted(seen) == sorted(expected_ids),
+            f"expected {sorted(expected_ids)}, got {sorted(seen)}"
+        )
+
+    def test_contacts_cache_invalidated(self, contact_id):
+        """Test a newly added contact shows up even after the list was cached"""
+        success, response = self.run_test(
+            "Get Contacts (after add)",
+            "GET",
+            "contacts",
+            200
+        )
+        return self.check(
+            "Contacts cache invalidated by add",
+            success and contact_id in [c['id'] for c in response],
+            f"{contact_id} missing from {response}"
+        )
+
+    def test_attachments(self, recipient_id, recipient_token):
+        """Test resumable upload, ranged download and access control for attachments"""
+        blob = b"0123456789"
+        success, attachment = self.run_test(
+            "Create Attachment",
+            "POST",
+            "attachments",
+            200,
+            data={"size": len(blob)}
+        )
+        if not success:
+            return False
+        attachment_id = attachment['id']
+
+        self.run_test("Upload First Chunk", "PUT", f"attachments/{attachment_id}/content?offset=0", 200, body=blob[:4])
+        self.run_test("Upload Chunk at Stale Offset (should fail)", "PUT", f"attachments/{attachment_id}/content?offset=0", 409, body=blob[:4])
+        success, status = self.run_test("Attachment Upload Status", "GET", f"attachments/{attachment_id}/status", 200)
+        self.check("Upload resumes at received offset", success and status.get('received') == 4, f"got {status}")
+        success, status = self.run_test("Upload Final Chunk", "PUT", f"attachments/{attachment_id}/content?offset=4", 200, body=blob[4:])
+        self.check("Upload complete", success and status.get('status') == 'complete', f"got {status}")
+
+        self.run_test("Download Attachment", "GET", f"attachments/{attachment_id}", 200)
+        self.check("Downloaded bytes match", self.last_response.content == blob, f"got {self.last_response.content!r}")
+
+        self.run_test("Download Attachment Range", "GET", f"attachments/{attachment_id}", 206, headers={'Range': 'bytes=2-5'})
+        self.check(
+            "Range response body and Content-Range",
+            self.last_response.content == blob[2:6]
+            and self.last_response.headers.get('Content-Range') == f"bytes 2-5/{len(blob)}",
+            f"got {self.last_response.content!r} {self.last_response.headers.get('Content-Range')}"
+        )
+        self.run_test("Download Unsatisfiable Range (should fail)", "GET", f"attachments/{attachment_id}", 416, headers={'Range': 'bytes=20-'})
+
+        owner_token = self.token
+        self.token = recipient_token
+        self.run_test("Download Unshared Attachment (should fail)", "GET", f"attachments/{attachment_id}", 404)
+        self.token = owner_token
+
+        self.run_test(
+            "Send Message with Attachment",
+            "POST",
+            "messages",
+            200,
+            data={
+                "receiver_id": recipient_id,
+                "encrypted_content": "encrypted_test_message",
+                "iv": "mock_iv",
+                "sender_public_key": "mock_sender_public_key",
+                "attachment_id": attachment_id
+            }
+        )
+        self.token = recipient_token
+        success, _ = self.run_test("Recipient Downloads Shared Attachment", "GET", f"attachments/{attachment_id}", 200)
+        self.token = owner_token
+        return success
+
     def test_create_audit_log(self, event_type="test_event"):
         """Test creating audit log"""
         success, response = self.run_test(
@@ -272,6 +419,26 @@ class SecureChatAPITester:
         )
         return success, response
 
+    def test_get_audit_logs_filtered(self, event_type="screenshot_attempt"):
+        """Test getting a page of audit logs filtered by event type"""
+        success, response = self.run_test(
+            "Get Audit Logs (filtered)",
+            "GET",
+            f"audit-logs?event_type={event_type}&limit=10",
+            200
+        )
+        return success, response
+
+    def test_get_audit_log_summary(self):
+        """Test getting hourly audit log counts"""
+        success, response = self.run_test(
+            "Get Audit Log Summary",
+            "GET",
+            "audit-logs/summary?granularity=hour",
+            200
+        )
+        return success, response
+
     def test_unauthorized_access(self):
         """Test unauthorized access should fail"""
         # Save current token
@@ -346,6 +513,7 @@ def main():
     success, user2_data = tester.test_register_user(test_username2, test_email2, test_password)
     if success:
         second_user_id = tester.user_id
+        second_user_token = tester.token
         tester.token = tester_temp_token  # Restore first user token
         tester.user_id = user1_data['user']['id'] if user1_data else None
     else:
@@ -358,13 +526,27 @@ def main():
     # Test 8: Get user (test with second user if available)
     if second_user_id:
         tester.test_get_user(second_user_id)
+        tester.test_get_user_not_modified(second_user_id)
+    tester.test_get_missing_user_with_wildcard_etag()
 
-    # Test 9: Add contact
+    # Test 9: Get contacts (primes the server-side contacts cache)
+    tester.test_get_contacts()
+
+    # Test 10: Add contact, which must invalidate the cached list
     if second_user_id:
         tester.test_add_contact(second_user_id)
+        tester.test_contacts_cache_invalidated(second_user_id)
 
-    # Test 10: Get contacts
-    tester.test_get_contacts()
+    # Test 10b: Contacts paging with a third user
+    if second_user_id:
+        tester_temp_token = tester.token
+        success, user3_data = tester.test_register_user(f"testuser3_{timestamp}", f"testuser3_{timestamp}@test.com", test_password)
+        tester.token = tester_temp_token
+        tester.user_id = user1_data['user']['id']
+        if success:
+            third_user_id = user3_data['user']['id']
+            tester.test_add_contact(third_user_id)
+            tester.test_get_contacts_page([second_user_id, third_user_id])
 
     # Test 11: Send message
     if second_user_id:
@@ -374,13 +556,23 @@ def main():
     if second_user_id:
         tester.test_get_messages(second_user_id)
 
+    # Test 12b: Attachments
+    if second_user_id:
+        tester.test_attachments(second_user_id, second_user_token)
+
     # Test 13: Create audit log
     tester.test_create_audit_log("screenshot_attempt")
 
     # Test 14: Get audit logs
     tester.test_get_audit_logs()
 
-    # Test 15: Unauthorized access should fail
+    # Test 15: Filtered audit logs
+    tester.test_get_audit_logs_filtered("screenshot_attempt")
+
+    # Test 16: Audit log summary
+    tester.test_get_audit_log_summary()
+
+    # Test 17: Unauthorized access should fail
     tester.test_unauthorized_access()
 
     # Print summary and return appropriate exit code
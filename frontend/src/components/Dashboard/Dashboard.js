@@ -15,6 +15,7 @@ import { AlertTriangle } from 'lucide-react';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const CONTACTS_PAGE_SIZE = 200;
 
 const Dashboard = () => {
   const { user, token, logout } = useAuth();
@@ -124,10 +125,20 @@ const Dashboard = () => {
 
   const loadContacts = async () => {
     try {
-      const response = await axios.get(`${API}/contacts`, {
-        headers: { Authorization: `Bearer ${token}` }
-      });
-      setContacts(response.data);
+      // Contacts are paged; X-Total-Count tells us how many there are in total
+      const allContacts = [];
+      let skip = 0;
+      let total = 0;
+      do {
+        const response = await axios.get(`${API}/contacts`, {
+          headers: { Authorization: `Bearer ${token}` },
+          params: { skip, limit: CONTACTS_PAGE_SIZE }
+        });
+        allContacts.push(...response.data);
+        total = Number(response.headers['x-total-count'] ?? allContacts.length);
+        skip += CONTACTS_PAGE_SIZE;
+      } while (skip < total);
+      setContacts(allContacts);
     } catch (error) {
       console.error('Failed to load contacts:', error);
     }